@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for the personal-data redaction and hashing primitives.
+
+Results are printed (or written) as JSON; pass --baseline with a
+previous run to flag cases that got slower than the allowed tolerance.
+"""
+
+import argparse
+import json
+import logging
+import platform
+import sys
+import timeit
+from typing import Callable, Dict, List
+
+import bcrypt
+
+from encrypt_password import hash_password, is_valid
+from filtered_logger import PII_FIELDS, RedactingFormatter, filter_datum
+
+
+def measure(func: Callable[[], object], number: int,
+            repeat: int = 5) -> float:
+    """Returns the best per-call time in seconds over `repeat` runs."""
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number
+
+
+def pii_fields(count: int) -> List[str]:
+    """Returns `count` field names to redact, PII_FIELDS first."""
+    return PII_FIELDS[:count] + [f'pii{i}' for i in
+                                 range(count - len(PII_FIELDS))]
+
+
+def make_message(fields: List[str], n_fields: int, density: float,
+                 length: int) -> str:
+    """
+    Builds a `key=value;` message of exactly `length` chars with
+    `n_fields` keys, roughly `density` of them taken from `fields`.
+    Returns None when `length` is too short for that many keys.
+    """
+    n_pii = min(round(n_fields * density), len(fields))
+    keys = fields[:n_pii] + [f'extra{i}' for i in range(n_fields - n_pii)]
+    spare = length - sum(len(key) + 2 for key in keys)
+    if spare < n_fields:
+        return None
+    sizes = [spare // n_fields] * n_fields
+    sizes[-1] += spare % n_fields
+    return ''.join(f'{key}={"x" * size};' for key, size in zip(keys, sizes))
+
+
+def bench_filter_datum(quick: bool) -> Dict[str, float]:
+    """
+    Redaction throughput across message lengths, field counts, PII
+    densities and the number of fields to redact.
+    """
+    results = {}
+    lengths = [64, 1024] if quick else [64, 256, 1024, 4096]
+    for n_redacted in (5, 20):
+        fields = pii_fields(n_redacted)
+        for length in lengths:
+            for n_fields in (5, 10, 20):
+                for density in (0.0, 0.5, 1.0):
+                    message = make_message(fields, n_fields, density, length)
+                    if message is None:
+                        continue
+                    key = f'filter_datum/redacted={n_redacted}' \
+                          f'/len={length}/fields={n_fields}' \
+                          f'/density={density}'
+                    results[key] = measure(
+                        lambda: filter_datum(fields, '***', message, ';'),
+                        number=200 if quick else 2000)
+    return results
+
+
+def bench_formatter(quick: bool) -> Dict[str, float]:
+    """Per-record cost of RedactingFormatter.format."""
+    formatter = RedactingFormatter(fields=PII_FIELDS)
+    message = make_message(PII_FIELDS, 8, 0.6, 256)
+
+    def run():
+        record = logging.LogRecord("user_data", logging.INFO, None, None,
+                                   message, None, None)
+        formatter.format(record)
+
+    return {'formatter/format': measure(run, 200 if quick else 2000)}
+
+
+def bench_bcrypt(quick: bool) -> Dict[str, float]:
+    """bcrypt hash and verify latency at several cost factors."""
+    results = {}
+    password = b'MyAmazingPassw0rd'
+    for rounds in ([4, 8] if quick else [4, 8, 10, 12]):
+        salt = bcrypt.gensalt(rounds)
+        hashed = bcrypt.hashpw(password, salt)
+        results[f'bcrypt/hash/cost={rounds}'] = measure(
+            lambda: bcrypt.hashpw(password, salt), 1, repeat=3)
+        results[f'bcrypt/verify/cost={rounds}'] = measure(
+            lambda: bcrypt.checkpw(password, hashed), 1, repeat=3)
+    hashed = hash_password('MyAmazingPassw0rd')
+    results['hash_password'] = measure(
+        lambda: hash_password('MyAmazingPassw0rd'), 1, repeat=3)
+    results['is_valid'] = measure(
+        lambda: is_valid(hashed, 'MyAmazingPassw0rd'), 1, repeat=3)
+    return results
+
+
+def compare(results: Dict[str, float], baseline: Dict[str, float],
+            tolerance: float) -> List[str]:
+    """Returns a line per case slower than baseline by over `tolerance`."""
+    regressions = []
+    for key, value in results.items():
+        old = baseline.get(key)
+        if old and value > old * (1 + tolerance):
+            regressions.append(
+                f'{key}: {old * 1e6:.1f}us -> {value * 1e6:.1f}us')
+    return regressions
+
+
+def main(argv: List[str] = None) -> int:
+    """Runs the benchmarks and returns a process exit code."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-o', '--output', help="write JSON results here")
+    parser.add_argument('--baseline', help="JSON results to compare with")
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help="allowed slowdown ratio (default: 0.2)")
+    parser.add_argument('--quick', action='store_true',
+                        help="fewer cases and iterations")
+    parser.add_argument('--skip-bcrypt', action='store_true',
+                        help="leave out the bcrypt cases")
+    args = parser.parse_args(argv)
+
+    results = {}
+    results.update(bench_filter_datum(args.quick))
+    results.update(bench_formatter(args.quick))
+    if not args.skip_bcrypt:
+        results.update(bench_bcrypt(args.quick))
+
+    report = {'python': platform.python_version(),
+              'machine': platform.machine(),
+              'results': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    else:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        print()
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f).get('results', {})
+        regressions = compare(results, baseline, args.tolerance)
+        for line in regressions:
+            print(f'REGRESSION {line}', file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
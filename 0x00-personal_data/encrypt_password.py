@@ -3,12 +3,22 @@
 Encrypting passwords
 """
 
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, List, Optional, Tuple
+
 import bcrypt
 
+MAX_WORKERS = int(os.environ.get("PASSWORD_HASH_WORKERS",
+                                 os.cpu_count() or 1))
+BCRYPT_ROUNDS = int(os.environ.get("PASSWORD_HASH_ROUNDS", 12))
+
 
-def hash_password(password: str) -> bytes:
+def hash_password(password: str, rounds: int = None) -> bytes:
     """Hashes the given password using bcrypt."""
-    salt = bcrypt.gensalt()
+    salt = bcrypt.gensalt(rounds or BCRYPT_ROUNDS)
     hashed_password = bcrypt.hashpw(password.encode('utf-8'), salt)
     return hashed_password
 
@@ -18,6 +28,101 @@ def is_valid(hashed_password: bytes, password: str) -> bool:
     return bcrypt.checkpw(password.encode('utf-8'), hashed_password)
 
 
+def calibrate_rounds(target_ms: float = 50, min_rounds: int = 4,
+                     max_rounds: int = 16) -> int:
+    """
+    Returns the highest bcrypt cost whose verify time on this host
+    stays within `target_ms` (never less than `min_rounds`).
+    """
+    password = b'calibration-password'
+    best = min_rounds
+    for rounds in range(min_rounds, max_rounds + 1):
+        hashed = bcrypt.hashpw(password, bcrypt.gensalt(rounds))
+        start = time.perf_counter()
+        bcrypt.checkpw(password, hashed)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        if elapsed_ms > target_ms:
+            break
+        best = rounds
+        if elapsed_ms * 2 > target_ms:
+            break
+    return best
+
+
+def get_rounds(hashed_password: bytes) -> int:
+    """Returns the cost factor stored in a bcrypt hash."""
+    return int(hashed_password.split(b'$')[2])
+
+
+def needs_rehash(hashed_password: bytes, rounds: int = None) -> bool:
+    """Tells whether a hash was made with a cost other than the target."""
+    try:
+        return get_rounds(hashed_password) != (rounds or BCRYPT_ROUNDS)
+    except (IndexError, ValueError):
+        return True
+
+
+def verify_and_upgrade(hashed_password: bytes, password: str,
+                       rounds: int = None) -> Tuple[bool, Optional[bytes]]:
+    """
+    Checks the password and, when it is valid but the hash uses an
+    outdated cost, also returns a fresh hash to store in its place.
+    """
+    if not is_valid(hashed_password, password):
+        return False, None
+    if needs_rehash(hashed_password, rounds):
+        return True, hash_password(password, rounds)
+    return True, None
+
+
+def hash_passwords(passwords: Iterable[str],
+                   max_workers: int = None) -> List[bytes]:
+    """Hashes passwords on a thread pool, returning them in input order."""
+    with ThreadPoolExecutor(max_workers or MAX_WORKERS) as executor:
+        return list(executor.map(hash_password, passwords))
+
+
+def are_valid(pairs: Iterable[Tuple[bytes, str]],
+              max_workers: int = None) -> List[bool]:
+    """Checks (hashed_password, password) pairs on a thread pool."""
+    with ThreadPoolExecutor(max_workers or MAX_WORKERS) as executor:
+        return list(executor.map(lambda pair: is_valid(*pair), pairs))
+
+
+async def hash_password_async(password: str) -> bytes:
+    """Hashes a password without blocking the event loop."""
+    return await asyncio.to_thread(hash_password, password)
+
+
+async def is_valid_async(hashed_password: bytes, password: str) -> bool:
+    """Checks a password without blocking the event loop."""
+    return await asyncio.to_thread(is_valid, hashed_password, password)
+
+
+async def hash_passwords_async(passwords: Iterable[str],
+                               max_workers: int = None) -> List[bytes]:
+    """Hashes passwords concurrently, at most `max_workers` at a time."""
+    limit = asyncio.Semaphore(max_workers or MAX_WORKERS)
+
+    async def _hash(password: str) -> bytes:
+        async with limit:
+            return await hash_password_async(password)
+
+    return list(await asyncio.gather(*(_hash(p) for p in passwords)))
+
+
+async def are_valid_async(pairs: Iterable[Tuple[bytes, str]],
+                          max_workers: int = None) -> List[bool]:
+    """Checks password pairs concurrently, at most `max_workers` at a time."""
+    limit = asyncio.Semaphore(max_workers or MAX_WORKERS)
+
+    async def _check(hashed_password: bytes, password: str) -> bool:
+        async with limit:
+            return await is_valid_async(hashed_password, password)
+
+    return list(await asyncio.gather(*(_check(*p) for p in pairs)))
+
+
 if __name__ == "__main__":
     password = "MyAmazingPassw0rd"
     encrypted_password = hash_password(password)
@@ -4,10 +4,21 @@ Module for filtering sensitive information from log messages.
 """
 
 import re
+import sys
 import logging
+import argparse
+import copy
+import json
+import atexit
+import threading
+import time
+from contextlib import contextmanager
+from logging.handlers import QueueHandler, QueueListener
+from queue import Empty, Full, LifoQueue, Queue
+from functools import lru_cache, partial
 from os import environ
 import mysql.connector
-from typing import List
+from typing import Any, Callable, List, Mapping, TextIO, Tuple
 import csv
 import os
 import mysql.connector
@@ -15,30 +26,94 @@ import mysql.connector
 PII_FIELDS = ["name", "email", "phone", "ssn", "password"]
 
 
+@lru_cache(maxsize=128)
+def _redactor(fields: Tuple[str, ...], redaction: str,
+              separator: str) -> Callable[[str], str]:
+    """Compiles the fields into one single-pass substitution."""
+    pattern = re.compile('({})=.*?{}'.format('|'.join(fields), separator))
+    return partial(pattern.sub, f'\\g<1>={redaction}{separator}')
+
+
 def filter_datum(fields: List[str], redaction: str,
                  message: str, separator: str) -> str:
     """Obfuscates sensitive information from a log message."""
-    for field in fields:
-        message = re.sub(f'{field}=.*?{separator}',
-                         f'{field}={redaction}{separator}', message)
-    return message
+    if not fields:
+        return message
+    return _redactor(tuple(fields), redaction, separator)(message)
+
+
+class BoundedQueueHandler(QueueHandler):
+    """QueueHandler that drops or blocks when its queue is full."""
+
+    def __init__(self, queue: Queue, block: bool = False):
+        """Constructor method"""
+        super(BoundedQueueHandler, self).__init__(queue)
+        self.block = block
+        self.dropped = 0
+
+    def enqueue(self, record: logging.LogRecord):
+        """Puts the record on the queue, honouring the full-queue policy."""
+        try:
+            self.queue.put(record, block=self.block)
+        except Full:
+            self.dropped += 1
+
+
+class DrainingQueueListener(QueueListener):
+    """QueueListener that waits for room to post its stop sentinel."""
+
+    def enqueue_sentinel(self):
+        """Blocks until the sentinel fits so no queued record is lost."""
+        self.queue.put(self._sentinel)
+
+
+_listener = None
+
+
+def stop_logger():
+    """Flushes pending records and stops the background listener."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
 
 
-def get_logger() -> logging.Logger:
-    """Returns a Logger object"""
+def get_logger(asynchronous: bool = False, queue_size: int = 10000,
+               block: bool = False,
+               json_lines: bool = False) -> logging.Logger:
+    """
+    Returns a Logger object.
+    In asynchronous mode records are only enqueued on the calling thread;
+    a background listener redacts them and writes to the stream.
+    """
     logger = logging.getLogger("user_data")
     logger.setLevel(logging.INFO)
     logger.propagate = False
 
-    formatter = RedactingFormatter(fields=PII_FIELDS)
+    stop_logger()
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+        handler.close()
+
+    formatter = RedactingFormatter(fields=PII_FIELDS, json_lines=json_lines)
     stream_handler = logging.StreamHandler()
     stream_handler.setFormatter(formatter)
 
-    logger.addHandler(stream_handler)
+    if asynchronous:
+        global _listener
+        log_queue = Queue(maxsize=queue_size)
+        _listener = DrainingQueueListener(log_queue, stream_handler)
+        _listener.start()
+        logger.addHandler(BoundedQueueHandler(log_queue, block))
+    else:
+        logger.addHandler(stream_handler)
 
     return logger
 
 
+atexit.register(stop_logger)
+
+
 def get_db() -> mysql.connector.connection.MySQLConnection:
     """Return a connector to the MySQL database."""
     username = environ.get("PERSONAL_DATA_DB_USERNAME", "root")
@@ -56,43 +131,228 @@ def get_db() -> mysql.connector.connection.MySQLConnection:
     return connection
 
 
-def main():
+class DBPool:
+    """
+    Fixed-size pool of connections created through `connect`
+    (get_db by default), validated on checkout and recycled
+    once older than `recycle` seconds.
+    """
+
+    def __init__(self, size: int = 5, recycle: float = 3600,
+                 connect: Callable[[], Any] = None):
+        """Constructor method"""
+        self.size = size
+        self.recycle = recycle
+        self.connect = connect or get_db
+        self.checkouts = 0
+        self.wait_time = 0.0
+        self._lock = threading.Lock()
+        self._idle = LifoQueue(maxsize=size)
+        self._checked_out = {}
+        for _ in range(size):
+            self._idle.put((None, 0.0))
+
+    def _is_usable(self, conn: Any, created_at: float) -> bool:
+        """Checks the connection is alive and not past its recycle age."""
+        if conn is None:
+            return False
+        if self.recycle and time.monotonic() - created_at > self.recycle:
+            return False
+        try:
+            return conn.is_connected()
+        except Exception:
+            return False
+
+    def acquire(self, timeout: float = None) -> Any:
+        """Checks a connection out of the pool, opening one if needed."""
+        start = time.monotonic()
+        try:
+            conn, created_at = self._idle.get(timeout=timeout)
+        except Empty:
+            raise TimeoutError("No database connection available")
+        with self._lock:
+            self.checkouts += 1
+            self.wait_time += time.monotonic() - start
+
+        if not self._is_usable(conn, created_at):
+            if conn is not None:
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+            try:
+                conn, created_at = self.connect(), time.monotonic()
+            except Exception:
+                self._idle.put((None, 0.0))
+                raise
+        self._checked_out[id(conn)] = created_at
+        return conn
+
+    def release(self, conn: Any):
+        """Returns a connection to the pool."""
+        created_at = self._checked_out.pop(id(conn), 0.0)
+        self._idle.put((conn, created_at))
+
+    @contextmanager
+    def connection(self, timeout: float = None):
+        """Context manager lending a connection for the block's duration."""
+        conn = self.acquire(timeout)
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def stats(self) -> dict:
+        """Returns checkout count and cumulative wait time in seconds."""
+        with self._lock:
+            return {"checkouts": self.checkouts,
+                    "wait_time": self.wait_time,
+                    "idle": self._idle.qsize()}
+
+    def close(self):
+        """Closes every idle connection held by the pool."""
+        for _ in range(self._idle.qsize()):
+            conn, _ = self._idle.get_nowait()
+            if conn is not None:
+                conn.close()
+            self._idle.put((None, 0.0))
+
+
+_pool = None
+
+
+def get_pool() -> DBPool:
+    """Returns the process-wide connection pool."""
+    global _pool
+    if _pool is None:
+        _pool = DBPool(
+            size=int(environ.get("PERSONAL_DATA_DB_POOL_SIZE", 5)),
+            recycle=float(environ.get("PERSONAL_DATA_DB_POOL_RECYCLE", 3600)))
+    return _pool
+
+
+def export_users(db: mysql.connector.connection.MySQLConnection,
+                 output: TextIO, batch_size: int = 1000,
+                 json_lines: bool = False) -> int:
+    """
+    Stream the users table to `output` in redacted batches and
+    return the number of rows written.
+    """
+    cursor = db.cursor(buffered=False)
+    cursor.execute("SELECT * FROM users;")
+    field_names = [i[0] for i in cursor.description]
+    formatter = RedactingFormatter(fields=PII_FIELDS, json_lines=json_lines)
+
+    count = 0
+    try:
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            lines = []
+            for row in rows:
+                record = logging.LogRecord(
+                    "user_data", logging.INFO, None, None, "", None, None)
+                record.row = dict(zip(field_names, row))
+                lines.append(formatter.format(record))
+            output.write('\n'.join(lines) + '\n')
+            output.flush()
+            count += len(rows)
+    finally:
+        cursor.close()
+    return count
+
+
+def main(argv: List[str] = None):
     """
     Retrieve all rows in the users table and display
     each row under a filtered format.
     """
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument('--stream', action='store_true',
+                        help="export in batches instead of logging rows")
+    parser.add_argument('--batch-size', type=int, default=1000,
+                        help="rows fetched and written per batch")
+    parser.add_argument('--output', default='-',
+                        help="file to write to in stream mode (- = stdout)")
+    parser.add_argument('--json', action='store_true',
+                        help="emit JSON lines instead of key=value;")
+    args = parser.parse_args(argv)
+
     db = get_db()
-    cursor = db.cursor()
-    cursor.execute("SELECT * FROM users;")
-    field_names = [i[0] for i in cursor.description]
+    try:
+        if args.stream:
+            if args.output == '-':
+                export_users(db, sys.stdout, args.batch_size, args.json)
+            else:
+                with open(args.output, 'w') as output:
+                    export_users(db, output, args.batch_size, args.json)
+            return
+
+        cursor = db.cursor()
+        cursor.execute("SELECT * FROM users;")
+        field_names = [i[0] for i in cursor.description]
 
-    logger = get_logger()
+        logger = get_logger(json_lines=args.json)
 
-    for row in cursor:
-        str_row = ''.join(f'{field}={str(value)}; ' for value,
-                          field in zip(row, field_names))
-        logger.info(str_row.strip())
+        for row in cursor:
+            logger.info("", extra={"row": dict(zip(field_names, row))})
 
-    cursor.close()
-    db.close()
+        cursor.close()
+    finally:
+        db.close()
 
 
 class RedactingFormatter(logging.Formatter):
-    """Redacting Formatter class."""
+    """
+    Redacting Formatter class.
+
+    Records carrying a `row` mapping (e.g. `extra={"row": {...}}`) are
+    redacted by key lookup instead of by regex. The original record is
+    never modified, so other handlers still see the raw message.
+    """
     REDACTION = "***"
     FORMAT = "[HOLBERTON] %(name)s %(levelname)s %(asctime)-15s: %(message)s"
     SEPARATOR = ";"
 
-    def __init__(self, fields: List[str]):
+    def __init__(self, fields: List[str], json_lines: bool = False):
         """Constructor method"""
         super(RedactingFormatter, self).__init__(self.FORMAT)
         self.fields = fields
+        self.json_lines = json_lines
+        self._field_set = frozenset(fields)
+
+    def redact_row(self, row: Mapping) -> dict:
+        """Returns a copy of row with the PII fields redacted."""
+        return {key: self.REDACTION if key in self._field_set else value
+                for key, value in row.items()}
 
     def format(self, record: logging.LogRecord) -> str:
         """Formats the specified log record as text."""
-        record.msg = filter_datum(
-            self.fields, self.REDACTION, record.getMessage(), self.SEPARATOR)
-        return super(RedactingFormatter, self).format(record)
+        row = getattr(record, 'row', None)
+        if isinstance(row, Mapping):
+            row = self.redact_row(row)
+            if self.json_lines:
+                return self._to_json(record, data=row)
+            message = ' '.join(f'{key}={value}{self.SEPARATOR}'
+                               for key, value in row.items())
+        else:
+            message = filter_datum(self.fields, self.REDACTION,
+                                   record.getMessage(), self.SEPARATOR)
+            if self.json_lines:
+                return self._to_json(record, message=message)
+
+        redacted = copy.copy(record)
+        redacted.msg = message
+        redacted.args = None
+        return super(RedactingFormatter, self).format(redacted)
+
+    def _to_json(self, record: logging.LogRecord, **payload) -> str:
+        """Serializes a redacted payload as a single JSON line."""
+        return json.dumps({"logger": record.name,
+                           "level": record.levelname,
+                           "time": self.formatTime(record),
+                           **payload}, default=str)
 
 
 if __name__ == '__main__':
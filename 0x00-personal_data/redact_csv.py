@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Parallel redaction of user_data.csv-style exports.
+
+The input is memory-mapped and split into newline-aligned byte ranges;
+a process pool redacts the PII_FIELDS columns of each range and the
+results are written out in the original order. At most a few chunks
+per worker are in flight, so memory is bounded by the chunk size even
+when the output is slower than the workers. Records are assumed not to
+contain embedded newlines.
+"""
+
+import argparse
+import csv
+import io
+import mmap
+import os
+import sys
+from collections import deque
+from multiprocessing import Pool
+from typing import List, Tuple
+
+from filtered_logger import PII_FIELDS, RedactingFormatter
+
+CHUNK_SIZE = 8 * 1024 * 1024
+IN_FLIGHT_PER_WORKER = 2
+
+
+def chunk_ranges(mm: mmap.mmap, start: int,
+                 chunk_size: int) -> List[Tuple[int, int]]:
+    """Splits mm[start:] into byte ranges that end on a newline."""
+    ranges = []
+    size = len(mm)
+    while start < size:
+        end = mm.find(b'\n', max(start, min(start + chunk_size, size) - 1))
+        end = size if end == -1 else end + 1
+        ranges.append((start, end))
+        start = end
+    return ranges
+
+
+def redact_range(args: Tuple[str, int, int, List[int], str]) -> bytes:
+    """Redacts the given columns of every record in one byte range."""
+    file_path, start, end, columns, redaction = args
+    with open(file_path, 'rb') as f, \
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        text = mm[start:end].decode('utf-8')
+
+    out = io.StringIO()
+    writer = csv.writer(out, quoting=csv.QUOTE_ALL, lineterminator='\n')
+    for row in csv.reader(io.StringIO(text)):
+        for i in columns:
+            if i < len(row):
+                row[i] = redaction
+        writer.writerow(row)
+    return out.getvalue().encode('utf-8')
+
+
+def redact_csv(file_path: str, output, fields: List[str] = PII_FIELDS,
+               redaction: str = RedactingFormatter.REDACTION,
+               workers: int = None, chunk_size: int = CHUNK_SIZE) -> int:
+    """
+    Writes a redacted copy of the CSV at `file_path` to the binary
+    stream `output` and returns the number of chunks processed.
+    """
+    if chunk_size < 1:
+        raise ValueError("chunk_size must be at least 1")
+    with open(file_path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return 0
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            header_end = mm.find(b'\n')
+            header_end = len(mm) if header_end == -1 else header_end + 1
+            header = mm[:header_end]
+            ranges = chunk_ranges(mm, header_end, chunk_size)
+
+    names = next(csv.reader([header.decode('utf-8')]), [])
+    columns = [i for i, name in enumerate(names) if name in fields]
+    output.write(header)
+
+    workers = workers or os.cpu_count() or 1
+    window = max(1, workers * IN_FLIGHT_PER_WORKER)
+    pending = deque()
+    with Pool(workers) as pool:
+        for start, end in ranges:
+            if len(pending) >= window:
+                output.write(pending.popleft().get())
+            pending.append(pool.apply_async(
+                redact_range, ((file_path, start, end, columns, redaction),)))
+        while pending:
+            output.write(pending.popleft().get())
+    return len(ranges)
+
+
+def main(argv: List[str] = None):
+    """Command-line entry point."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('input', help="CSV file to redact")
+    parser.add_argument('-o', '--output', default='-',
+                        help="destination file (- = stdout)")
+    parser.add_argument('-j', '--workers', type=int, default=None,
+                        help="worker processes (default: CPU count)")
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE,
+                        help="approximate bytes per chunk")
+    args = parser.parse_args(argv)
+    if args.chunk_size < 1:
+        parser.error("--chunk-size must be at least 1")
+
+    if args.output == '-':
+        redact_csv(args.input, sys.stdout.buffer,
+                   workers=args.workers, chunk_size=args.chunk_size)
+    else:
+        with open(args.output, 'wb') as output:
+            redact_csv(args.input, output,
+                       workers=args.workers, chunk_size=args.chunk_size)
+
+
+if __name__ == '__main__':
+    main()
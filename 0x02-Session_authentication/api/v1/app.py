@@ -13,6 +13,12 @@ app.register_blueprint(app_views)
 CORS(app, resources={r"/api/v1/*": {"origins": "*"}})
 auth = None
 AUTH_TYPE = getenv("AUTH_TYPE")
+EXCLUDED_PATHS = (
+    '/api/v1/status/',
+    '/api/v1/unauthorized/',
+    '/api/v1/forbidden/',
+    '/api/v1/auth_session/login/'
+)
 
 if AUTH_TYPE == "auth":
     from api.v1.auth.auth import Auth
@@ -38,18 +44,12 @@ def bef_req():
     if auth is None:
         pass
     else:
-        setattr(request, "current_user", auth.current_user(request))
-        excluded = [
-            '/api/v1/status/',
-            '/api/v1/unauthorized/',
-            '/api/v1/forbidden/',
-            '/api/v1/auth_session/login/'
-        ]
-        if auth.require_auth(request.path, excluded):
+        user = auth.resolve_user(request)
+        if auth.require_auth(request.path, EXCLUDED_PATHS):
             cookie = auth.session_cookie(request)
             if auth.authorization_header(request) is None and cookie is None:
                 abort(401, description="Unauthorized")
-            if auth.current_user(request) is None:
+            if user is None:
                 abort(403, description="Forbidden")
 
 @app.errorhandler(404)
@@ -4,9 +4,56 @@ Definition of class Auth for managing API authentication
 """
 
 import os
+import re
 from flask import request
 from typing import List, TypeVar
 
+UNRESOLVED = object()
+
+
+def normalize_path(path: str) -> str:
+    """
+    Strip the trailing slash of a path, keeping the root as "/".
+    """
+    return path.rstrip('/') or '/'
+
+
+class PathMatcher:
+    """
+    Matcher for a fixed set of excluded path patterns.
+
+    Exact patterns go in a set and every pattern containing `*` (which
+    matches any run of characters) goes into one compiled regex, both
+    compared after trailing-slash normalization.
+    """
+
+    def __init__(self, patterns: List[str]):
+        """
+        Compile the patterns.
+        """
+        exact = set()
+        wildcards = []
+        for pattern in patterns:
+            pattern = normalize_path(pattern)
+            if '*' in pattern:
+                wildcards.append('.*'.join(
+                    re.escape(part) for part in pattern.split('*')))
+            else:
+                exact.add(pattern)
+        self.exact = frozenset(exact)
+        self.regex = None
+        if wildcards:
+            self.regex = re.compile('(?:{})\\Z'.format('|'.join(wildcards)))
+
+    def matches(self, path: str) -> bool:
+        """
+        Tell whether a path matches one of the patterns.
+        """
+        path = normalize_path(path)
+        if path in self.exact:
+            return True
+        return self.regex is not None and self.regex.match(path) is not None
+
 
 class Auth:
     """
@@ -16,22 +63,16 @@ class Auth:
     def require_auth(self, path: str, excluded_paths: List[str]) -> bool:
         """
         Determines whether a given path requires authentication or not.
+        The matcher is compiled once per excluded_paths object.
         """
         if path is None:
             return True
-        elif not excluded_paths or excluded_paths == []:
+        if not excluded_paths:
             return True
-        elif path in excluded_paths:
-            return False
-        else:
-            for i in excluded_paths:
-                if (
-                    i.startswith(path) or
-                    path.startswith(i) or
-                    (i[-1] == "*" and path.startswith(i[:-1]))
-                ):
-                    return False
-        return True
+        if getattr(self, '_excluded_paths', None) is not excluded_paths:
+            self._path_matcher = PathMatcher(excluded_paths)
+            self._excluded_paths = excluded_paths
+        return not self._path_matcher.matches(path)
 
     def authorization_header(self, request=None) -> str:
         """
@@ -48,6 +89,19 @@ class Auth:
         """
         return None
 
+    def resolve_user(self, request=None) -> TypeVar('User'):
+        """
+        Returns current_user(request), computed at most once per request.
+        The result, None included, is kept as request.current_user.
+        """
+        if request is None:
+            return None
+        user = getattr(request, 'current_user', UNRESOLVED)
+        if user is UNRESOLVED:
+            user = self.current_user(request)
+            setattr(request, 'current_user', user)
+        return user
+
     def session_cookie(self, request=None):
         """
         Returns a cookie from a request.
@@ -5,16 +5,160 @@ Basic Authorization protocol methods
 """
 
 import base64
+import hashlib
+import hmac
+import os
+import threading
+import time
+from collections import OrderedDict
 from .auth import Auth
-from typing import TypeVar
+from typing import Callable, TypeVar
 from models.user import User
 
 
+class CredentialCache:
+    """
+    Bounded LRU cache of verified Basic Authorization headers.
+
+    Entries are keyed on an HMAC of the raw header under a per-process
+    secret, so no credential is kept in clear, and map to the id, email
+    and password hash of the user it authenticated. They expire after
+    `ttl` seconds, are dropped as soon as their user is saved with
+    another email or password or removed, and a hit is only served
+    while the user still has the email and password hash that were
+    verified, so changes picked up by `sync` or made by another worker
+    take effect at once.
+    """
+
+    def __init__(self, size: int = 1024, ttl: float = 300):
+        """
+        Initialize an empty cache holding at most `size` entries.
+        """
+        self.size = size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._secret = os.urandom(32)
+        self._entries = OrderedDict()
+        self._by_user = {}
+        self._lock = threading.Lock()
+
+    def key(self, header: str) -> bytes:
+        """
+        Return the cache key of an Authorization header.
+        """
+        return hmac.new(self._secret, header.encode('utf-8'),
+                        hashlib.sha256).digest()
+
+    def get(self, key: bytes,
+            load: Callable[[str], TypeVar('User')]) -> TypeVar('User'):
+        """
+        Return the user cached under a key, fetched with `load`, or None.
+        An entry whose user is gone or has another email or password
+        hash than the ones verified counts as a miss and is dropped.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[3] <= time.monotonic():
+                self._drop(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+        user = load(entry[0])
+        with self._lock:
+            if user is None or self._stale(entry, user):
+                if self._entries.get(key) is entry:
+                    self._drop(key)
+                    self.invalidations += 1
+                self.misses += 1
+                return None
+            self.hits += 1
+        return user
+
+    def put(self, key: bytes, user: TypeVar('User')):
+        """
+        Remember that the header under `key` authenticates `user`.
+        """
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (user.id, user.email, user.password,
+                                  time.monotonic() + self.ttl)
+            self._by_user.setdefault(user.id, set()).add(key)
+            while len(self._entries) > self.size:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    @staticmethod
+    def _stale(entry: tuple, user: TypeVar('User')) -> bool:
+        """
+        Return True if `user` no longer has the email or password hash
+        verified for the entry.
+        """
+        return entry[1] != user.email or entry[2] != user.password
+
+    def _drop(self, key: bytes):
+        """
+        Remove one entry; the caller holds the lock.
+        """
+        user_id = self._entries.pop(key)[0]
+        keys = self._by_user[user_id]
+        keys.discard(key)
+        if not keys:
+            del self._by_user[user_id]
+
+    def on_change(self, users: list, removed: bool = False):
+        """
+        Drop the entries of users removed or saved with a new email or
+        password.
+        """
+        with self._lock:
+            for user in users:
+                for key in list(self._by_user.get(user.id, ())):
+                    if removed or self._stale(self._entries[key], user):
+                        self._drop(key)
+                        self.invalidations += 1
+
+    def clear(self):
+        """
+        Remove every entry.
+        """
+        with self._lock:
+            self._entries.clear()
+            self._by_user.clear()
+
+    def stats(self) -> dict:
+        """
+        Return hit, miss, eviction and invalidation counts.
+        """
+        with self._lock:
+            return {"hits": self.hits,
+                    "misses": self.misses,
+                    "evictions": self.evictions,
+                    "invalidations": self.invalidations,
+                    "size": len(self._entries)}
+
+
+CREDENTIAL_CACHE = CredentialCache(
+    size=int(os.getenv("BASIC_AUTH_CACHE_SIZE", 1024)),
+    ttl=float(os.getenv("BASIC_AUTH_CACHE_TTL", 300)))
+User.add_listener(CREDENTIAL_CACHE.on_change)
+
+
 class BasicAuth(Auth):
     """
     Implement Basic Authorization protocol methods
+
+    Verified headers are remembered in `credential_cache`, so repeated
+    requests skip decoding, the user search and the password hash.
     """
 
+    credential_cache = CREDENTIAL_CACHE
+
     def extract_base64_authorization_header(self,
                                             authorization_header:
                                             str) -> str:
@@ -85,12 +229,19 @@ class BasicAuth(Auth):
         Returns a User instance based on a received request.
         """
         auth_header = self.authorization_header(request)
-        if auth_header:
-            token = self.extract_base64_authorization_header(auth_header)
-            if token:
-                decoded = self.decode_base64_authorization_header(token)
-                if decoded:
-                    email, pword = self.extract_user_credentials(decoded)
-                    if email:
-                        return self.user_object_from_credentials(email, pword)
-        return None
+        if not auth_header or not isinstance(auth_header, str):
+            return None
+        key = self.credential_cache.key(auth_header)
+        user = self.credential_cache.get(key, User.get)
+        if user is not None:
+            return user
+        token = self.extract_base64_authorization_header(auth_header)
+        if token:
+            decoded = self.decode_base64_authorization_header(token)
+            if decoded:
+                email, pword = self.extract_user_credentials(decoded)
+                if email:
+                    user = self.user_object_from_credentials(email, pword)
+        if user is not None:
+            self.credential_cache.put(key, user)
+        return user
@@ -7,8 +7,20 @@ from flask import Blueprint
 from api.v1.views.index import *
 from api.v1.views.users import *
 from api.v1.views.session_auth import *
+from models.base import SYNC_INTERVAL
 from models.user import User
+from models.user_session import UserSession
 
 app_views = Blueprint("app_views", __name__, url_prefix="/api/v1")
 
 User.load_from_file()
+
+
+@app_views.before_app_request
+def sync_models():
+    """
+    Pick up users and sessions written by other worker processes.
+    """
+    if SYNC_INTERVAL is not None:
+        User.sync()
+        UserSession.sync()
@@ -2,17 +2,143 @@
 """ Module of Users views
 """
 from api.v1.views import app_views
-from flask import abort, jsonify, request
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime, timezone
+from flask import Response, abort, jsonify, request, stream_with_context
+from hashlib import sha1
+from models.base import TIMESTAMP_FORMAT
 from models.user import User
+import binascii
+import json
+
+MAX_PAGE_SIZE = 1000
+STREAM_BATCH_SIZE = 500
+
+
+def encode_cursor(user: User) -> str:
+    """
+    Build the opaque cursor pointing just after a user.
+    """
+    key = [user.created_at.strftime(TIMESTAMP_FORMAT), user.id]
+    return urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> tuple:
+    """
+    Turn a cursor back into a (created_at, id) ordering key.
+    """
+    created_at, user_id = json.loads(urlsafe_b64decode(cursor.encode()))
+    return (datetime.strptime(created_at, TIMESTAMP_FORMAT), user_id)
+
+
+def stream_users():
+    """
+    Yield the JSON array of all users chunk by chunk.
+    """
+    yield b'['
+    first = True
+    for user in User.iter_ordered(STREAM_BATCH_SIZE):
+        yield user.to_json_bytes() if first else b',' + user.to_json_bytes()
+        first = False
+    yield b']'
+
+
+def user_validators(user: User) -> tuple:
+    """
+    Return the (ETag, Last-Modified) pair of a user.
+    The ETag digests the public JSON form, so it only depends on what
+    is persisted and agrees across reloads and workers.
+    """
+    etag = "{}-{}".format(user.id,
+                          sha1(user.to_json_bytes()).hexdigest()[:16])
+    last_modified = user.updated_at.replace(microsecond=0,
+                                            tzinfo=timezone.utc)
+    return etag, last_modified
+
+
+def is_not_modified(etag: str, last_modified: datetime = None) -> bool:
+    """
+    Tell whether the request's conditional headers match the resource.
+    If-None-Match takes precedence over If-Modified-Since.
+    """
+    if request.if_none_match:
+        return request.if_none_match.contains(etag)
+    if last_modified is not None and request.if_modified_since:
+        return last_modified <= request.if_modified_since
+    return False
+
+
+def conditional(response: Response, etag: str,
+                last_modified: datetime = None) -> Response:
+    """
+    Attach the validators to a response.
+    """
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    return response
+
+
+def view_user(user: User) -> Response:
+    """
+    Return a user's JSON, or 304 when the client copy is current.
+    """
+    etag, last_modified = user_validators(user)
+    if is_not_modified(etag, last_modified):
+        return conditional(Response(status=304), etag, last_modified)
+    return conditional(jsonify(user.to_json()), etag, last_modified)
 
 
 @app_views.route('/users', methods=['GET'], strict_slashes=False)
 def view_all_users() -> str:
     """
     Get a list of all User objects in JSON representation.
+    With `limit` (and optionally `cursor`) return one page ordered by
+    creation date; with `stream=1` stream the whole list.
+    """
+    etag = "users-{}-{}".format(
+        User.generation(), sha1(request.query_string).hexdigest()[:12])
+    if is_not_modified(etag):
+        return conditional(Response(status=304), etag)
+    response = list_users()
+    if response.status_code == 200:
+        conditional(response, etag)
+    return response
+
+
+def wrong_format() -> Response:
+    """
+    Build the 400 response for malformed query parameters.
     """
-    all_users = [user.to_json() for user in User.all()]
-    return jsonify(all_users)
+    response = jsonify({'error': "Wrong format"})
+    response.status_code = 400
+    return response
+
+
+def list_users() -> Response:
+    """
+    Build the GET /users response for the request's parameters.
+    """
+    if request.args.get('stream') in ('1', 'true'):
+        return Response(stream_with_context(stream_users()),
+                        mimetype='application/json')
+    if 'limit' not in request.args and 'cursor' not in request.args:
+        body = b','.join(user.to_json_bytes() for user in User.all())
+        return Response(b'[' + body + b']', mimetype='application/json')
+
+    try:
+        limit = int(request.args.get('limit', MAX_PAGE_SIZE))
+        cursor = request.args.get('cursor')
+        after = decode_cursor(cursor) if cursor else None
+    except (ValueError, TypeError, binascii.Error):
+        return wrong_format()
+    if limit < 1:
+        return wrong_format()
+    limit = min(limit, MAX_PAGE_SIZE)
+    page = User.paginate(limit, after)
+    next_cursor = encode_cursor(page[-1]) if len(page) == limit else None
+    return jsonify({"users": [user.to_json() for user in page],
+                    "next_cursor": next_cursor})
 
 
 @app_views.route('/users/<user_id>', methods=['GET'], strict_slashes=False)
@@ -25,14 +151,13 @@ def view_one_user(user_id: str = None) -> str:
     if user_id == "me":
         if request.current_user is None:
             abort(404)
-        user = request.current_user
-        return jsonify(user.to_json())
+        return view_user(request.current_user)
     user = User.get(user_id)
     if user is None:
         abort(404)
     if request.current_user is None:
         abort(404)
-    return jsonify(user.to_json())
+    return view_user(user)
 
 
 @app_views.route('/users/<user_id>', methods=['DELETE'], strict_slashes=False)
@@ -49,30 +174,51 @@ def delete_user(user_id: str = None) -> str:
     return jsonify({}), 200
 
 
+def build_user(user_data: dict) -> tuple:
+    """
+    Validate a create payload and return (User, None) or (None, error).
+    The user is not saved.
+    """
+    if not isinstance(user_data, dict):
+        return None, "Wrong format"
+    if user_data.get("email", "") == "":
+        return None, "email missing"
+    if user_data.get("password", "") == "":
+        return None, "password missing"
+    try:
+        user = User()
+        user.email = user_data.get("email")
+        user.password = user_data.get("password")
+        user.first_name = user_data.get("first_name")
+        user.last_name = user_data.get("last_name")
+        return user, None
+    except Exception as e:
+        return None, "Can't create User: {}".format(e)
+
+
+def apply_update(user: User, user_data: dict):
+    """
+    Copy the updatable fields of a payload onto a user.
+    """
+    if user_data.get('first_name') is not None:
+        user.first_name = user_data.get('first_name')
+    if user_data.get('last_name') is not None:
+        user.last_name = user_data.get('last_name')
+
+
 @app_views.route('/users', methods=['POST'], strict_slashes=False)
 def create_user() -> str:
     """
     Create a new User object and return its JSON representation
     """
     user_data = None
-    error_msg = None
     try:
         user_data = request.get_json()
     except Exception as e:
         user_data = None
-    if user_data is None:
-        error_msg = "Wrong format"
-    if error_msg is None and user_data.get("email", "") == "":
-        error_msg = "email missing"
-    if error_msg is None and user_data.get("password", "") == "":
-        error_msg = "password missing"
+    user, error_msg = build_user(user_data)
     if error_msg is None:
         try:
-            user = User()
-            user.email = user_data.get("email")
-            user.password = user_data.get("password")
-            user.first_name = user_data.get("first_name")
-            user.last_name = user_data.get("last_name")
             user.save()
             return jsonify(user.to_json()), 201
         except Exception as e:
@@ -97,9 +243,55 @@ def update_user(user_id: str = None) -> str:
         user_data = None
     if user_data is None:
         return jsonify({'error': "Wrong format"}), 400
-    if user_data.get('first_name') is not None:
-        user.first_name = user_data.get('first_name')
-    if user_data.get('last_name') is not None:
-        user.last_name = user_data.get('last_name')
+    apply_update(user, user_data)
     user.save()
     return jsonify(user.to_json()), 200
+
+
+@app_views.route('/users/batch', methods=['POST'], strict_slashes=False)
+def batch_users() -> str:
+    """
+    Create or update many users from a JSON array or NDJSON body.
+    Items with an `id` update that user, the others create one; all
+    changes are persisted with a single flush and a result is
+    returned per item, in order.
+    """
+    if request.mimetype == 'application/x-ndjson':
+        items = []
+        for line in request.get_data().splitlines():
+            if not line.strip():
+                continue
+            try:
+                items.append(json.loads(line))
+            except ValueError:
+                items.append(None)
+    else:
+        try:
+            items = request.get_json()
+        except Exception:
+            items = None
+        if not isinstance(items, list):
+            return jsonify({'error': "Wrong format"}), 400
+
+    results, to_save = [], []
+    for item in items:
+        if isinstance(item, dict) and item.get("id") is not None:
+            user = User.get(item.get("id"))
+            if user is None:
+                results.append({"status": 404, "error": "Not found"})
+                continue
+            apply_update(user, item)
+            results.append({"status": 200, "user": user})
+        else:
+            user, error_msg = build_user(item)
+            if error_msg is not None:
+                results.append({"status": 400, "error": error_msg})
+                continue
+            results.append({"status": 201, "user": user})
+        to_save.append(user)
+
+    User.save_many(to_save)
+    for result in results:
+        if "user" in result:
+            result["user"] = result["user"].to_json()
+    return jsonify(results), 200
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+Memory benchmark: bytes per User with __slots__ vs a per-instance dict.
+
+Usage: python3 -m benchmarks.model_memory [count]
+"""
+
+import sys
+import tracemalloc
+
+from models.user import User
+
+DEFAULT_COUNT = 1000000
+
+
+class DictUser:
+    """Stand-in for the previous __dict__-based model layout."""
+
+
+def build(count: int, slotted: bool) -> list:
+    """Create `count` users in the requested layout."""
+    objs = []
+    for i in range(count):
+        user = User(email=f"user{i}@example.com", first_name="First",
+                    last_name=f"Last{i}", _password="0" * 64)
+        if not slotted:
+            legacy = DictUser()
+            legacy.__dict__.update(user._attributes())
+            user = legacy
+        objs.append(user)
+    return objs
+
+
+def measure(count: int, slotted: bool) -> float:
+    """Return the traced bytes per object for one layout."""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    objs = build(count, slotted)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del objs
+    return (after - before) / count
+
+
+def main(count: int):
+    """Print bytes per object for both layouts."""
+    legacy = measure(count, False)
+    slotted = measure(count, True)
+    print(f"{count} users")
+    print(f"  __dict__  {legacy:8.1f} bytes/object")
+    print(f"  __slots__ {slotted:8.1f} bytes/object")
+    print(f"  saved     {1 - slotted / legacy:8.1%}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_COUNT)
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Benchmark: sorted-index queries vs scanning User.all().
+
+Usage: python3 -m benchmarks.query [count]
+"""
+
+import sys
+import timeit
+from datetime import datetime, timedelta
+
+from models import base, file_storage
+from models.user import User
+
+DEFAULT_COUNT = 100000
+EPOCH = datetime(2020, 1, 1)
+
+
+def populate(count: int):
+    """Fill DATA with `count` users spread over `count` seconds."""
+    base.set_storage(file_storage.FileStorage())
+    file_storage.DATA["User"] = {}
+    for i in range(count):
+        created_at = (EPOCH + timedelta(seconds=i)).strftime(
+            base.TIMESTAMP_FORMAT)
+        user = User(email=f"user{i:07d}@example{i % 10}.com",
+                    created_at=created_at)
+        file_storage.DATA["User"][user.id] = user
+    base.STORAGE.reindex(User)
+
+
+def scan_range(start, end):
+    """Users created in [start, end), by scanning."""
+    return sorted((u for u in User.all() if start <= u.created_at < end),
+                  key=User.order_key)
+
+
+def scan_prefix(prefix):
+    """Users whose email starts with prefix, by scanning."""
+    return sorted((u for u in User.all() if u.email.startswith(prefix)),
+                  key=lambda u: (u.email, u.id))
+
+
+def scan_newest(limit):
+    """The newest `limit` users, by scanning."""
+    return sorted(User.all(), key=User.order_key, reverse=True)[:limit]
+
+
+def main(count: int):
+    """Time each query shape both ways."""
+    populate(count)
+    start = EPOCH + timedelta(seconds=count // 2)
+    end = start + timedelta(seconds=100)
+    cases = [
+        ("range 100", lambda: User.query('created_at', start, end),
+         lambda: scan_range(start, end)),
+        ("prefix", lambda: User.query('email', prefix="user00001"),
+         lambda: scan_prefix("user00001")),
+        ("newest 10",
+         lambda: User.query('created_at', descending=True, limit=10),
+         lambda: scan_newest(10)),
+    ]
+    print(f"{count} users")
+    for name, indexed, scan in cases:
+        assert [u.id for u in indexed()] == [u.id for u in scan()]
+        t_index = min(timeit.repeat(indexed, number=20, repeat=3)) / 20
+        t_scan = min(timeit.repeat(scan, number=1, repeat=3))
+        print(f"  {name:<10} index {t_index * 1e6:10.1f}us  "
+              f"scan {t_scan * 1e6:12.1f}us  x{t_scan / t_index:.0f}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_COUNT)
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Benchmark: Auth.require_auth with a compiled matcher vs the old
+per-pattern loop, plus a table of expected matches.
+
+Usage: python3 -m benchmarks.require_auth
+"""
+
+import timeit
+
+from api.v1.auth.auth import Auth
+
+EXCLUDED = ['/api/v1/status/', '/api/v1/unauthorized/',
+            '/api/v1/forbidden/', '/api/v1/auth_session/login/',
+            '/api/v1/stat*']
+CASES = [
+    ("/api/v1/status", False),
+    ("/api/v1/status/", False),
+    ("/api/v1/stats", False),
+    ("/api/v1/forbidden", False),
+    ("/api/v1/auth_session/login", False),
+    ("/api/v1/users", True),
+    ("/api/v1/users/", True),
+    ("/api/v1/", True),
+    ("/api/v1", True),
+    ("/api/v1/forbidden/extra", True),
+    ("/api/v1/unauthorizedX", True),
+    ("/", True),
+]
+
+
+def loop_require_auth(path, excluded_paths):
+    """The previous implementation, for comparison."""
+    if path is None or not excluded_paths:
+        return True
+    if path in excluded_paths:
+        return False
+    for i in excluded_paths:
+        if (i.startswith(path) or path.startswith(i) or
+                (i[-1] == "*" and path.startswith(i[:-1]))):
+            return False
+    return True
+
+
+def main():
+    """Print the correctness table, then time both implementations."""
+    auth = Auth()
+    print(f"{'path':<30} {'expected':>8} {'compiled':>8} {'loop':>8}")
+    for path, expected in CASES:
+        got = auth.require_auth(path, EXCLUDED)
+        old = loop_require_auth(path, EXCLUDED)
+        print(f"{path:<30} {expected!s:>8} {got!s:>8} {old!s:>8}")
+        assert got == expected, path
+
+    for n_patterns in (5, 50, 500):
+        excluded = EXCLUDED + [f"/api/v1/extra{i}/" for i in range(
+            n_patterns - len(EXCLUDED))]
+        for path in ("/api/v1/status", "/api/v1/users/abc"):
+            compiled = min(timeit.repeat(
+                lambda: auth.require_auth(path, excluded),
+                number=10000, repeat=3)) / 10000
+            loop = min(timeit.repeat(
+                lambda: loop_require_auth(path, excluded),
+                number=10000, repeat=3)) / 10000
+            print(f"{n_patterns:>4} patterns {path:<20} "
+                  f"compiled {compiled * 1e9:8.0f}ns  "
+                  f"loop {loop * 1e9:8.0f}ns")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+Startup benchmark: load_from_file with JSON vs binary snapshots.
+
+Usage: python3 -m benchmarks.snapshot_load [count ...]
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+from models import base, file_storage
+from models.user import User
+
+DEFAULT_COUNTS = (10000, 100000, 1000000)
+
+
+def populate(count: int):
+    """Fill DATA with `count` users without touching the disk."""
+    file_storage.DATA["User"] = {}
+    for i in range(count):
+        user = User(email=f"user{i}@example.com", first_name="First",
+                    last_name=f"Last{i}", _password="0" * 64)
+        file_storage.DATA["User"][user.id] = user
+
+
+def time_load(fmt: str) -> float:
+    """Write a snapshot in `fmt` and return the seconds to load it."""
+    storage = base.STORAGE
+    for other in file_storage.SNAPSHOT_EXTENSIONS:
+        if os.path.exists(storage.snapshot_path(User, other)):
+            os.remove(storage.snapshot_path(User, other))
+    tmp_path = storage.dump_snapshot(User, dict(file_storage.DATA["User"]),
+                                     fmt)
+    os.replace(tmp_path, storage.snapshot_path(User, fmt))
+    size = os.path.getsize(storage.snapshot_path(User, fmt))
+    start = time.perf_counter()
+    User.load_from_file()
+    elapsed = time.perf_counter() - start
+    print(f"  {fmt:<6} {elapsed:8.3f}s  {size / 1e6:8.1f} MB")
+    return elapsed
+
+
+def main(counts):
+    """Run the benchmark for every object count."""
+    os.chdir(tempfile.mkdtemp())
+    base.set_storage(file_storage.FileStorage())
+    for count in counts:
+        print(f"{count} users")
+        populate(count)
+        json_time = time_load("json")
+        populate(count)
+        binary_time = time_load("binary")
+        print(f"  speedup {json_time / binary_time:.1f}x")
+
+
+if __name__ == "__main__":
+    main([int(n) for n in sys.argv[1:]] or DEFAULT_COUNTS)
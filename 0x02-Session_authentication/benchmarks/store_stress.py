@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Multithreaded stress test for the in-memory model store.
+
+Every thread creates, updates, searches and removes its own users while
+the others do the same; afterwards the store, its indexes and the
+files written during the run must agree. Throughput is reported per
+storage mode and thread count.
+
+Writes are serialized (per class, then by FILE_LOCK) and the GIL
+serializes the rest, so throughput does not grow with threads. In json
+mode it drops, because every save rewrites the whole snapshot while the
+class lock is held. The journal mode appends one record per save.
+
+Usage: python3 -m benchmarks.store_stress [ops_per_thread]
+"""
+
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from models import base, file_storage
+from models.user import User
+
+THREAD_COUNTS = (1, 2, 4, 8)
+MODES = ("json", "journal")
+
+
+def worker(tid: int, ops: int, errors: list):
+    """Run a mix of writes and reads for one thread."""
+    try:
+        mine = []
+        for i in range(ops):
+            user = User(email=f"t{tid}-{i}@example.com")
+            user.save()
+            mine.append(user)
+            if i % 3 == 0:
+                user.first_name = "Renamed"
+                user.save()
+            found = User.search({"email": user.email})
+            assert found and found[0].id == user.id, "lost own write"
+            len(User.all())
+            if i % 4 == 0:
+                mine.pop(0).remove()
+    except Exception as e:
+        errors.append(e)
+
+
+def check_consistency():
+    """
+    Ensure DATA, the email index and the files written during the run
+    agree.
+    """
+    users = {obj_id: (user.email, user.first_name)
+             for obj_id, user in file_storage.DATA["User"].items()}
+    for user in file_storage.DATA["User"].values():
+        assert User.search({"email": user.email})[0] is user
+    indexed = sum(len(bucket) for bucket in
+                  file_storage.INDEXES["User"]["email"].values())
+    assert indexed == len(users), "index out of sync"
+    User.load_from_file()
+    on_disk = {obj_id: (user.email, user.first_name)
+               for obj_id, user in file_storage.DATA["User"].items()}
+    assert on_disk == users, "file out of sync"
+
+
+def run(mode: str, threads: int, ops: int) -> float:
+    """
+    Return operations per second for the given storage mode and
+    thread count.
+    """
+    base.set_storage(file_storage.FileStorage(journal=mode == "journal"))
+    file_storage.DATA["User"] = {}
+    User.save_to_file()
+    User.load_from_file()
+    errors = []
+    pool = [threading.Thread(target=worker, args=(t, ops, errors))
+            for t in range(threads)]
+    start = time.perf_counter()
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    elapsed = time.perf_counter() - start
+    if errors:
+        raise errors[0]
+    check_consistency()
+    return threads * ops / elapsed
+
+
+def main(ops: int):
+    """Run the stress test for every thread count."""
+    os.chdir(tempfile.mkdtemp())
+    for mode in MODES:
+        for threads in THREAD_COUNTS:
+            rate = run(mode, threads, ops)
+            print(f"{mode:<8} {threads} threads: {rate:10.0f} ops/s  "
+                  f"consistent")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 300)
@@ -4,28 +4,86 @@ Base module for managing objects
 """
 
 from datetime import datetime
-from typing import TypeVar, List, Iterable
-from os import path
+from typing import Callable, TypeVar, List, Iterable
+from os import getenv
+import atexit
 import json
+import logging
+import threading
 import uuid
+from models.file_storage import FileStorage, WRITE_BEHIND_INTERVAL
+from models.storage import SQLiteStorage, Storage
 
 TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S"
-DATA = {}
+MODEL_STORAGE = getenv("MODEL_STORAGE", "json")
+SQLITE_PATH = getenv("MODEL_SQLITE_PATH", ".db.sqlite3")
+SYNC_INTERVAL = getenv("MODEL_SYNC_INTERVAL")
+SYNC_INTERVAL = float(SYNC_INTERVAL) if SYNC_INTERVAL else None
+GENERATIONS = {}
+BOOT_ID = uuid.uuid4().hex[:8]
+CLASS_LOCKS = {}
+FIELDS = {}
+LISTENERS = {}
+logger = logging.getLogger(__name__)
+
+
+def make_storage(name: str) -> Storage:
+    """
+    Return the storage backend for a MODEL_STORAGE value: "json" (the
+    default, snapshot files), "journal" (snapshot plus append-only
+    journal) or "sqlite".
+    """
+    if name == "sqlite":
+        return SQLiteStorage(SQLITE_PATH)
+    if name in ("json", "journal"):
+        if SYNC_INTERVAL is not None and WRITE_BEHIND_INTERVAL > 0:
+            logger.warning("MODEL_SYNC_INTERVAL with write-behind lets "
+                           "workers overwrite each other's changes; "
+                           "use MODEL_STORAGE=journal instead")
+        return FileStorage(journal=name == "journal")
+    raise ValueError(f"Unknown MODEL_STORAGE {name!r}: "
+                     "expected json, journal or sqlite")
+
+
+STORAGE = make_storage(MODEL_STORAGE)
+
+
+def set_storage(storage: Storage):
+    """
+    Replace the storage backend every model class delegates to.
+    """
+    global STORAGE
+    STORAGE = storage
 
 
 class Base():
     """
     Base class for object management
+
+    Every lookup and write is delegated to the storage backend in
+    `STORAGE` (see `models.storage.Storage`), chosen with MODEL_STORAGE;
+    `FileStorage`, the default, keeps objects in memory and persists
+    them to files.
+
+    Subclasses may list attributes in `_indexed_attributes` and
+    `_sorted_attributes` for the backend to index, for equality lookups
+    and for range/prefix lookups and ordering respectively.
+
+    Attributes are declared in `__slots__` so instances carry no
+    per-object `__dict__`; subclasses that do not declare slots still
+    work and keep their extra attributes in `__dict__`.
     """
 
+    __slots__ = ('id', 'created_at', 'updated_at', '_json_cache')
+    _transient_attributes: tuple = ('_json_cache',)
+    _indexed_attributes: tuple = ()
+    _sorted_attributes: tuple = ('created_at',)
+    _datetime_attributes: tuple = ('created_at', 'updated_at')
+
     def __init__(self, *args: list, **kwargs: dict):
         """
         Initialize a Base instance.
         """
-        selfClass = str(self.__class__.__name__)
-        if DATA.get(selfClass) is None:
-            DATA[selfClass] = {}
-
         self.id = kwargs.get('id', str(uuid.uuid4()))
         self.created_at = datetime.strptime(
             kwargs.get('created_at',
@@ -48,76 +106,206 @@ class Base():
                 return False
                 return self.id == other.id
 
+    def __setattr__(self, name: str, value: object):
+        """
+        Set an attribute and drop the cached serialized forms.
+        """
+        object.__setattr__(self, name, value)
+        if name != '_json_cache':
+            object.__setattr__(self, '_json_cache', None)
+
+    def _cache(self) -> dict:
+        """
+        Return the serialization cache of the object.
+        """
+        cache = getattr(self, '_json_cache', None)
+        if cache is None:
+            cache = {}
+            object.__setattr__(self, '_json_cache', cache)
+        return cache
+
     def to_json(self, for_serialization: bool = False) -> dict:
         """
         Convert the object to a JSON dictionary.
+        The result is cached until an attribute of the object is set.
+        """
+        cache = self._cache()
+        result = cache.get(for_serialization)
+        if result is None:
+            result = {}
+            for key, value in self._attributes().items():
+                if not for_serialization and key[0] == '_':
+                    continue
+                if type(value) is datetime:
+                    result[key] = value.strftime(TIMESTAMP_FORMAT)
+                else:
+                    result[key] = value
+            cache[for_serialization] = result
+        return dict(result)
+
+    def to_json_bytes(self) -> bytes:
+        """
+        Return the public JSON form encoded, ready to be spliced into
+        a response body. Cached like `to_json`.
+        """
+        cache = self._cache()
+        encoded = cache.get('bytes')
+        if encoded is None:
+            encoded = json.dumps(self.to_json()).encode()
+            cache['bytes'] = encoded
+        return encoded
+
+    @classmethod
+    def _fields(cls) -> tuple:
+        """
+        Return the slot attribute names of the class, base first.
+        """
+        fields = FIELDS.get(cls)
+        if fields is None:
+            fields = tuple(
+                name for klass in reversed(cls.__mro__)
+                for name in klass.__dict__.get('__slots__', ())
+                if name not in ('__dict__', '__weakref__')
+                and name not in cls._transient_attributes)
+            FIELDS[cls] = fields
+        return fields
+
+    def _attributes(self) -> dict:
+        """
+        Return the attributes set on the object, slots first.
         """
         result = {}
-        for key, value in self.__dict__.items():
-            if not for_serialization and key[0] == '_':
+        for name in self._fields():
+            try:
+                result[name] = getattr(self, name)
+            except AttributeError:
                 continue
-            if type(value) is datetime:
-                result[key] = value.strftime(TIMESTAMP_FORMAT)
-            else:
-                result[key] = value
+        result.update(getattr(self, '__dict__', {}))
         return result
 
     @classmethod
     def load_from_file(cls):
         """
-        Load all objects from file.
+        Load all objects of the class from the storage backend.
         """
-        selfClass = cls.__name__
-        file_path = f".db_{selfClass}.json"
-        DATA[selfClass] = {}
-        if not path.exists(file_path):
-            return
+        STORAGE.load(cls)
 
-        with open(file_path, 'r') as f:
-            objs_json = json.load(f)
-            for obj_id, obj_json in objs_json.items():
-                DATA[selfClass][obj_id] = cls(**obj_json)
+    @classmethod
+    def sync(cls, interval: float = None) -> bool:
+        """
+        Pick up changes other processes made to the class data,
+        checking at most once per `interval` seconds (SYNC_INTERVAL by
+        default). Returns True when the data storage changed.
+        """
+        if interval is None:
+            interval = SYNC_INTERVAL or 0
+        return STORAGE.sync(cls, interval)
 
     @classmethod
     def save_to_file(cls):
         """
         Save all objects to file.
         """
-        selfClass = cls.__name__
-        file_path = f".db_{selfClass}.json"
-        objs_json = {
-            obj_id: obj.to_json(True) for obj_id,
-            obj in DATA[selfClass].items()
-            }
+        STORAGE.save_all(cls)
+
+    @staticmethod
+    def flush():
+        """
+        Persist the changes the storage backend has deferred.
+        """
+        STORAGE.flush()
 
-        with open(file_path, 'w') as f:
-            json.dump(objs_json, f)
+    @classmethod
+    def _lock(cls) -> threading.RLock:
+        """
+        Return the lock guarding writes to the class data.
+        """
+        lock = CLASS_LOCKS.get(cls.__name__)
+        if lock is None:
+            lock = CLASS_LOCKS.setdefault(cls.__name__, threading.RLock())
+        return lock
 
     def save(self):
         """
         Save the current object to the data storage.
         """
-        selfClass = self.__class__.__name__
-        self.updated_at = datetime.utcnow()
-        DATA[selfClass][self.id] = self
-        self.__class__.save_to_file()
+        self.__class__.save_many([self])
 
     def remove(self):
         """
         Removes object.
         """
-        selfClass = self.__class__.__name__
-        if DATA[selfClass].get(self.id) is not None:
-            del DATA[selfClass][self.id]
-            self.__class__.save_to_file()
+        self.__class__.remove_many([self])
+
+    @classmethod
+    def _bump_generation(cls):
+        """
+        Record that the class data changed.
+        """
+        with cls._lock():
+            GENERATIONS[cls.__name__] = GENERATIONS.get(cls.__name__, 0) + 1
+
+    @classmethod
+    def generation(cls) -> str:
+        """
+        Return a token that changes whenever objects of the class
+        change: the storage backend's own token when it can see writes
+        from other processes, otherwise a count of the saves, removals
+        and reloads in this process.
+        """
+        token = STORAGE.generation(cls)
+        if token is not None:
+            return token
+        return f"{BOOT_ID}-{GENERATIONS.get(cls.__name__, 0)}"
+
+    @classmethod
+    def add_listener(cls, callback: Callable[[list, bool], None]):
+        """
+        Register callback(objs, removed) to be called whenever objects
+        of the class are saved or removed.
+        """
+        LISTENERS.setdefault(cls.__name__, []).append(callback)
+
+    @classmethod
+    def _notify(cls, objs: list, removed: bool = False):
+        """
+        Call the listeners of the class with the saved or removed objects.
+        """
+        for callback in LISTENERS.get(cls.__name__, ()):
+            callback(objs, removed)
+
+    @classmethod
+    def save_many(cls, objs: Iterable[TypeVar('Base')]):
+        """
+        Save several objects of the class with one persistence flush.
+        The generation is bumped once the change is applied and
+        persisted, so a new ETag never goes with old data; updated_at
+        is kept to the whole seconds that are persisted.
+        """
+        objs = list(objs)
+        now = datetime.utcnow().replace(microsecond=0)
+        for obj in objs:
+            obj.updated_at = now
+        STORAGE.save_many(objs)
+        cls._bump_generation()
+        cls._notify(objs)
+
+    @classmethod
+    def remove_many(cls, objs: Iterable[TypeVar('Base')]):
+        """
+        Remove several objects of the class with one persistence flush.
+        """
+        objs = list(objs)
+        STORAGE.remove_many(objs)
+        cls._bump_generation()
+        cls._notify(objs, removed=True)
 
     @classmethod
     def count(cls) -> int:
         """
         Count the total number of objects in the data storage.
         """
-        selfClass = cls.__name__
-        return len(DATA[selfClass])
+        return STORAGE.count(cls)
 
     @classmethod
     def all(cls) -> Iterable[TypeVar('Base')]:
@@ -126,24 +314,65 @@ class Base():
         """
         return cls.search()
 
+    def order_key(self) -> tuple:
+        """
+        Return the stable (created_at, id) ordering key of the object.
+        """
+        return (self.created_at, self.id)
+
+    @classmethod
+    def paginate(cls, limit: int,
+                 after: tuple = None) -> List[TypeVar('Base')]:
+        """
+        Retrieve up to `limit` objects ordered by (created_at, id),
+        starting just after the `after` ordering key.
+        """
+        return STORAGE.paginate(cls, limit, after)
+
+    @classmethod
+    def iter_ordered(cls,
+                     batch_size: int = 500) -> Iterable[TypeVar('Base')]:
+        """
+        Iterate over all objects ordered by (created_at, id), fetching
+        them from the storage backend `batch_size` at a time.
+        """
+        after = None
+        while True:
+            page = cls.paginate(batch_size, after)
+            yield from page
+            if len(page) < batch_size:
+                return
+            after = page[-1].order_key()
+
+    @classmethod
+    def query(cls, attr: str, start: object = None, end: object = None,
+              prefix: str = None, descending: bool = False,
+              limit: int = None, offset: int = 0) -> List[TypeVar('Base')]:
+        """
+        Retrieve objects ordered by `attr` (then id) whose value lies
+        in [start, end) and/or starts with `prefix`, skipping `offset`
+        and returning at most `limit` of them.
+        """
+        if prefix:
+            start = prefix if start is None else max(start, prefix)
+            upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+            end = upper if end is None else min(end, upper)
+        return STORAGE.query(cls, attr, start, end, descending,
+                             limit, offset)
+
     @classmethod
     def get(cls, id: str) -> TypeVar('Base'):
         """
         Retrieve one object by its unique ID from the data storage.
         """
-        selfClass = cls.__name__
-        return DATA[selfClass].get(id)
+        return STORAGE.get(cls, id)
 
     @classmethod
     def search(cls, attributes: dict = {}) -> List[TypeVar('Base')]:
         """
         Search for objects in the data storage with matching attributes.
         """
-        selfClass = cls.__name__
+        return STORAGE.search(cls, attributes)
 
-        def _search(obj):
-            if not attributes:
-                return True
-            return all(getattr(obj, k) == v for k, v in attributes.items())
 
-        return list(filter(_search, DATA[selfClass].values()))
+atexit.register(Base.flush)
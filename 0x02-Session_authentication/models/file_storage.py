@@ -0,0 +1,692 @@
+#!/usr/bin/env python3
+"""
+File storage backend for model objects.
+
+Objects live in the in-memory `DATA` store (class name -> id -> object)
+and are persisted to `.db_<Class>.json` (or `.bin`) snapshots, either
+rewritten on every change or, in journal mode, complemented by an
+append-only `.db_<Class>.journal` that is compacted into the snapshot
+once it grows past JOURNAL_MAX_BYTES.
+"""
+
+from contextlib import contextmanager
+from datetime import datetime
+from os import getenv, path
+from typing import List
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+from models import snapshot
+from models.storage import Storage
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+SNAPSHOT_FORMAT = getenv("MODEL_SNAPSHOT_FORMAT", "json")
+SNAPSHOT_EXTENSIONS = {"json": "json", "binary": "bin"}
+JOURNAL_MAX_BYTES = int(getenv("MODEL_JOURNAL_MAX_BYTES", 1024 * 1024))
+FILE_LOCK = threading.RLock()
+LOCK_FILES = {}
+WRITE_BEHIND_INTERVAL = float(getenv("MODEL_WRITE_BEHIND_INTERVAL", 0))
+WRITE_BEHIND_MAX_DIRTY = int(getenv("MODEL_WRITE_BEHIND_MAX_DIRTY", 100))
+WRITE_BEHIND_STATS = {"marked": 0, "pending": 0,
+                      "flushes": 0, "coalesced": 0}
+FILE_STATE = {}
+DIRTY = {}
+DIRTY_LOCK = threading.Lock()
+_flush_requested = threading.Event()
+_flusher = None
+DATA = {}
+INDEXES = {}
+SORTED_INDEXES = {}
+INDEXED_VALUES = {}
+logger = logging.getLogger(__name__)
+
+
+class FileStorage(Storage):
+    """
+    Store model objects in memory, persisted to files.
+
+    Classes may list attributes in `_indexed_attributes` to get a hash
+    index (value -> objects) that `search` uses for equality lookups,
+    and in `_sorted_attributes` to get a sorted index that `query` and
+    `paginate` use for range/prefix lookups and ordering; indexes
+    reflect the state of objects as last saved.
+
+    Writers take the per-class lock, held until their change is
+    persisted so files record changes in the order they were applied,
+    and file access is serialized by `_file_lock` (FILE_LOCK plus a
+    flock shared with other processes); readers take no lock and work
+    on snapshots of `DATA`.
+
+    Several processes may share the files in journal mode and in json
+    mode, where writers sync the class from disk before rewriting the
+    snapshot. Write-behind cannot be shared, since it writes changes
+    later from memory.
+    """
+
+    def __init__(self, journal: bool = False):
+        """
+        Initialize the backend, appending changes to a journal when
+        `journal` is set instead of rewriting the snapshot.
+        """
+        self.journal = journal
+
+    def objects(self, cls: type) -> dict:
+        """
+        Return the id -> object mapping of a class.
+        """
+        objs = DATA.get(cls.__name__)
+        if objs is None:
+            objs = DATA.setdefault(cls.__name__, {})
+        return objs
+
+    def load(self, cls: type):
+        """
+        Load all objects of a class from file.
+        The newest snapshot (JSON or binary) is read first, then any
+        journal records on top.
+        """
+        selfClass = cls.__name__
+        if selfClass in DIRTY:
+            self.flush()
+        with self._file_lock(cls):
+            objs = self._read_snapshot(cls)
+            self._replay_journal(cls, self._journal_path(cls) + ".1", objs)
+            offset = self._replay_journal(cls, self._journal_path(cls),
+                                          objs)
+        with cls._lock():
+            DATA[selfClass] = objs
+            self.reindex(cls)
+            cls._bump_generation()
+            FILE_STATE[selfClass] = {
+                "snapshot": self._snapshot_signature(cls),
+                "journal": self._journal_signature(cls, offset),
+                "checked": time.monotonic(),
+            }
+
+    def _read_snapshot(self, cls: type) -> dict:
+        """
+        Return the objects (id -> object) of the newest snapshot file,
+        JSON or binary.
+        """
+        objs = {}
+        snapshots = [(path.getmtime(self.snapshot_path(cls, fmt)), fmt)
+                     for fmt in SNAPSHOT_EXTENSIONS
+                     if path.exists(self.snapshot_path(cls, fmt))]
+        if not snapshots:
+            return objs
+        fmt = max(snapshots)[1]
+        file_path = self.snapshot_path(cls, fmt)
+        if fmt == "binary":
+            with open(file_path, 'rb') as f:
+                return snapshot.load(cls, f)
+        with open(file_path, 'r') as f:
+            objs_json = json.load(f)
+            for obj_id, obj_json in objs_json.items():
+                objs[obj_id] = cls(**obj_json)
+        return objs
+
+    def _snapshot_signature(self, cls: type) -> tuple:
+        """
+        Return the (inode, mtime, size) of every snapshot file.
+        """
+        signature = []
+        for fmt in SNAPSHOT_EXTENSIONS:
+            try:
+                st = os.stat(self.snapshot_path(cls, fmt))
+            except FileNotFoundError:
+                signature.append(None)
+                continue
+            signature.append((st.st_ino, st.st_mtime_ns, st.st_size))
+        return tuple(signature)
+
+    def _journal_signature(self, cls: type, offset: int = None) -> tuple:
+        """
+        Return the (inode, offset) of the journal, offset defaulting
+        to its current size.
+        """
+        try:
+            st = os.stat(self._journal_path(cls))
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_size if offset is None else offset)
+
+    def sync(self, cls: type, interval: float = 0) -> bool:
+        """
+        Pick up changes other processes made to the class files.
+        Checks at most once per `interval` seconds; journal growth is
+        applied record by record, anything else reloads the class.
+        Returns True when the data storage changed.
+        """
+        selfClass = cls.__name__
+        state = FILE_STATE.get(selfClass)
+        if state is None:
+            self.load(cls)
+            return True
+        now = time.monotonic()
+        if now - state["checked"] < interval:
+            return False
+        state["checked"] = now
+
+        if state["snapshot"] != self._snapshot_signature(cls):
+            self.load(cls)
+            return True
+        journal = self._journal_signature(cls)
+        known = state["journal"]
+        if journal == known or (journal is None and known is None):
+            return False
+        if journal is None or known is None or journal[0] != known[0] \
+                or journal[1] < known[1]:
+            self.load(cls)
+            return True
+
+        changes = {}
+        offset = self._replay_journal(cls, self._journal_path(cls),
+                                      changes, known[1], removed=True)
+        with cls._lock():
+            objs = self.objects(cls)
+            for obj_id, obj in changes.items():
+                self._index_remove(cls, obj_id)
+                if obj is None:
+                    objs.pop(obj_id, None)
+                    continue
+                objs[obj_id] = obj
+                self._index_add(cls, obj)
+            state["journal"] = (known[0], offset)
+            if changes:
+                cls._bump_generation()
+        return bool(changes)
+
+    def snapshot_path(self, cls: type, fmt: str = None) -> str:
+        """
+        Return the path of the class snapshot file in the given format.
+        """
+        extension = SNAPSHOT_EXTENSIONS[fmt or SNAPSHOT_FORMAT]
+        return f".db_{cls.__name__}.{extension}"
+
+    def convert_snapshot(self, cls: type, fmt: str):
+        """
+        Load the class from its current files and rewrite its
+        snapshot in the given format.
+        """
+        self.load(cls)
+        tmp_path = self.dump_snapshot(cls, dict(self.objects(cls)), fmt)
+        os.replace(tmp_path, self.snapshot_path(cls, fmt))
+
+    def _journal_path(self, cls: type) -> str:
+        """
+        Return the path of the class journal file.
+        """
+        return f".db_{cls.__name__}.journal"
+
+    def _replay_journal(self, cls: type, journal_path: str, objs: dict,
+                        offset: int = 0, removed: bool = False) -> int:
+        """
+        Apply the records of a journal file, from byte `offset` on,
+        to objs (id -> object); with `removed`, removals are kept as
+        None entries instead of popped. A torn last line is ignored.
+        Returns the offset just past the last complete record.
+        """
+        if not path.exists(journal_path):
+            return offset
+        with open(journal_path, 'rb') as f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                offset += len(line)
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if entry.get("op") == "save":
+                    objs[entry["id"]] = cls(**entry["obj"])
+                elif entry.get("op") == "remove":
+                    if removed:
+                        objs[entry["id"]] = None
+                    else:
+                        objs.pop(entry["id"], None)
+        return offset
+
+    def _append_journal(self, cls: type, *entries: dict):
+        """
+        Append records to the journal in one write and compact it once
+        it has grown past JOURNAL_MAX_BYTES.
+        """
+        journal_path = self._journal_path(cls)
+        lines = "".join(json.dumps(entry, separators=(',', ':')) + "\n"
+                        for entry in entries)
+        with self._file_lock(cls):
+            with open(journal_path, 'ab') as f:
+                start = f.tell()
+                f.write(lines.encode())
+                size = f.tell()
+            self._track_own_append(cls, start, size)
+            if size < JOURNAL_MAX_BYTES or \
+                    path.exists(journal_path + ".1"):
+                return
+            os.replace(journal_path, journal_path + ".1")
+            state = FILE_STATE.get(cls.__name__)
+            if state is not None and state["journal"] is not None \
+                    and state["journal"][1] == size:
+                state["journal"] = None
+        threading.Thread(target=self._compact, args=(cls,),
+                         daemon=True).start()
+
+    def _track_own_append(self, cls: type, start: int, end: int):
+        """
+        Move the sync offset past a record this process appended,
+        provided nothing from elsewhere was pending before it.
+        """
+        state = FILE_STATE.get(cls.__name__)
+        if state is None:
+            return
+        journal = self._journal_signature(cls, start)
+        if state["journal"] == journal or \
+                (state["journal"] is None and start == 0):
+            state["journal"] = (journal[0], end)
+
+    def _remember_snapshot(self, cls: type):
+        """
+        Record that the snapshot files now hold this process' data.
+        """
+        state = FILE_STATE.get(cls.__name__)
+        if state is not None:
+            state["snapshot"] = self._snapshot_signature(cls)
+            state["journal"] = self._journal_signature(cls)
+
+    def _compact(self, cls: type):
+        """
+        Fold the rotated journal into the snapshot on disk, unless a
+        full save_all has superseded it in the meantime.
+        Only file contents are used, so records other processes
+        appended are kept and unsaved in-memory changes stay out.
+        """
+        rotated_path = self._journal_path(cls) + ".1"
+        with self._file_lock(cls):
+            if not path.exists(rotated_path):
+                return
+            objs = self._read_snapshot(cls)
+            self._replay_journal(cls, rotated_path, objs)
+            tmp_path = self.dump_snapshot(cls, objs)
+            os.replace(tmp_path, self.snapshot_path(cls))
+            os.remove(rotated_path)
+            state = FILE_STATE.get(cls.__name__)
+            if state is not None:
+                state["snapshot"] = self._snapshot_signature(cls)
+
+    def dump_snapshot(self, cls: type, objs: dict, fmt: str = None) -> str:
+        """
+        Write the given objects to a temporary snapshot file and
+        return its path.
+        """
+        fmt = fmt or SNAPSHOT_FORMAT
+        file_path = self.snapshot_path(cls, fmt)
+        tmp_path = f"{file_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        if fmt == "binary":
+            with open(tmp_path, 'wb') as f:
+                snapshot.dump(objs, f)
+                f.flush()
+                os.fsync(f.fileno())
+            return tmp_path
+
+        objs_json = {
+            obj_id: obj.to_json(True) for obj_id, obj in objs.items()
+        }
+        with open(tmp_path, 'w') as f:
+            json.dump(objs_json, f)
+            f.flush()
+            os.fsync(f.fileno())
+        return tmp_path
+
+    @contextmanager
+    def _file_lock(self, cls: type):
+        """
+        Hold FILE_LOCK and an exclusive flock on the class lock file,
+        so appends, rotations, compactions and snapshot rewrites of all
+        processes sharing the files are serialized. Reentrant within a
+        process; without fcntl only FILE_LOCK is taken.
+        """
+        with FILE_LOCK:
+            if fcntl is None:
+                yield
+                return
+            lock_path = path.abspath(f".db_{cls.__name__}.lock")
+            entry = LOCK_FILES.get(lock_path)
+            if entry is None:
+                entry = LOCK_FILES[lock_path] = [open(lock_path, 'a'), 0]
+            if entry[1] == 0:
+                fcntl.flock(entry[0], fcntl.LOCK_EX)
+            entry[1] += 1
+            try:
+                yield
+            finally:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    fcntl.flock(entry[0], fcntl.LOCK_UN)
+
+    def reindex(self, cls: type):
+        """
+        Rebuild the secondary indexes of a class from the data storage
+        and swap them in at once.
+        """
+        selfClass = cls.__name__
+        indexes = {attr: {} for attr in cls._indexed_attributes}
+        sorted_indexes = {attr: [] for attr in cls._sorted_attributes}
+        values = {}
+        for obj in list(self.objects(cls).values()):
+            hash_keys, sorted_keys = self._index_keys(cls, obj)
+            for attr, value in hash_keys.items():
+                indexes[attr].setdefault(value, {})[obj.id] = obj
+            for attr, value in sorted_keys.items():
+                sorted_indexes[attr].append((value, obj.id))
+            values[obj.id] = (hash_keys, sorted_keys)
+        for entries in sorted_indexes.values():
+            entries.sort()
+        INDEXES[selfClass] = indexes
+        SORTED_INDEXES[selfClass] = sorted_indexes
+        INDEXED_VALUES[selfClass] = values
+
+    def indexes(self, cls: type) -> dict:
+        """
+        Return the hash indexes of a class, building them if needed.
+        """
+        if cls.__name__ not in INDEXES:
+            with cls._lock():
+                if cls.__name__ not in INDEXES:
+                    self.reindex(cls)
+        return INDEXES[cls.__name__]
+
+    def sorted_indexes(self, cls: type) -> dict:
+        """
+        Return the sorted indexes of a class, building them if needed.
+        """
+        self.indexes(cls)
+        return SORTED_INDEXES[cls.__name__]
+
+    def _index_keys(self, cls: type, obj: object) -> tuple:
+        """
+        Return the values of obj for the hash and the sorted indexes.
+        Unhashable values are left out of the hash indexes, and values
+        of another type than the sorted index (datetime for
+        `_datetime_attributes`, str otherwise), None included, out of
+        the sorted ones.
+        """
+        hash_keys = {}
+        for attr in cls._indexed_attributes:
+            value = getattr(obj, attr, None)
+            try:
+                hash(value)
+            except TypeError:
+                continue
+            hash_keys[attr] = value
+        sorted_keys = {}
+        for attr in cls._sorted_attributes:
+            value = getattr(obj, attr, None)
+            kind = datetime if attr in cls._datetime_attributes else str
+            if type(value) is kind:
+                sorted_keys[attr] = value
+        return hash_keys, sorted_keys
+
+    def _index_add(self, cls: type, obj: object):
+        """
+        Add an object to every index and remember the indexed values.
+        """
+        indexes = self.indexes(cls)
+        sorted_indexes = SORTED_INDEXES[cls.__name__]
+        hash_keys, sorted_keys = self._index_keys(cls, obj)
+        for attr, value in hash_keys.items():
+            indexes[attr].setdefault(value, {})[obj.id] = obj
+        for attr, value in sorted_keys.items():
+            bisect.insort(sorted_indexes[attr], (value, obj.id))
+        INDEXED_VALUES[cls.__name__][obj.id] = (hash_keys, sorted_keys)
+
+    def _index_remove(self, cls: type, obj_id: str):
+        """
+        Drop an object from every index it was added to.
+        """
+        indexes = self.indexes(cls)
+        sorted_indexes = SORTED_INDEXES[cls.__name__]
+        hash_keys, sorted_keys = \
+            INDEXED_VALUES[cls.__name__].pop(obj_id, ({}, {}))
+        for attr, value in hash_keys.items():
+            bucket = indexes[attr].get(value)
+            if bucket is not None:
+                bucket.pop(obj_id, None)
+                if not bucket:
+                    del indexes[attr][value]
+        for attr, value in sorted_keys.items():
+            entries = sorted_indexes[attr]
+            i = bisect.bisect_left(entries, (value, obj_id))
+            if i < len(entries) and entries[i] == (value, obj_id):
+                del entries[i]
+
+    def save_all(self, cls: type):
+        """
+        Write every object of a class to a new snapshot and drop the
+        journal it supersedes.
+        """
+        with self._file_lock(cls):
+            tmp_path = self.dump_snapshot(cls, dict(self.objects(cls)))
+            os.replace(tmp_path, self.snapshot_path(cls))
+            for journal_path in (self._journal_path(cls),
+                                 self._journal_path(cls) + ".1"):
+                if path.exists(journal_path):
+                    os.remove(journal_path)
+            self._remember_snapshot(cls)
+
+    def _persist(self, cls: type, objs: List[object],
+                 removed: bool = False):
+        """
+        Record saves/removals according to the storage mode, with a
+        single write whatever the number of objects.
+        """
+        if self.journal:
+            if removed:
+                self._append_journal(cls, *({"op": "remove", "id": obj.id}
+                                            for obj in objs))
+            else:
+                self._append_journal(cls, *({"op": "save", "id": obj.id,
+                                             "obj": obj.to_json(True)}
+                                            for obj in objs))
+        elif WRITE_BEHIND_INTERVAL > 0:
+            self._mark_dirty(cls)
+        else:
+            self.save_all(cls)
+
+    def _mark_dirty(self, cls: type):
+        """
+        Queue the class for the next write-behind flush.
+        """
+        global _flusher
+        with DIRTY_LOCK:
+            WRITE_BEHIND_STATS["marked"] += 1
+            if cls.__name__ in DIRTY:
+                WRITE_BEHIND_STATS["coalesced"] += 1
+            DIRTY[cls.__name__] = cls
+            WRITE_BEHIND_STATS["pending"] += 1
+            pending = WRITE_BEHIND_STATS["pending"]
+            if _flusher is None:
+                _flusher = threading.Thread(target=_flush_loop,
+                                            args=(self,), daemon=True)
+                _flusher.start()
+        if pending >= WRITE_BEHIND_MAX_DIRTY:
+            _flush_requested.set()
+
+    def flush(self):
+        """
+        Write every class with pending write-behind changes to file.
+        A class whose write fails stays dirty and the first error is
+        raised once the other classes have been written.
+        """
+        with DIRTY_LOCK:
+            classes = list(DIRTY.values())
+            DIRTY.clear()
+            WRITE_BEHIND_STATS["pending"] = 0
+        error = None
+        for cls in classes:
+            try:
+                self.save_all(cls)
+            except Exception as e:
+                with DIRTY_LOCK:
+                    DIRTY.setdefault(cls.__name__, cls)
+                    WRITE_BEHIND_STATS["pending"] += 1
+                error = error or e
+                continue
+            WRITE_BEHIND_STATS["flushes"] += 1
+        if error is not None:
+            raise error
+
+    @contextmanager
+    def _merging(self, cls: type):
+        """
+        When every change rewrites the whole snapshot (json mode without
+        write-behind), hold the file lock and pick up what other
+        processes wrote first, so the rewrite does not drop their
+        changes; journal appends need neither.
+        """
+        if self.journal or WRITE_BEHIND_INTERVAL > 0:
+            yield
+            return
+        with self._file_lock(cls):
+            self.sync(cls, 0)
+            yield
+
+    def save_many(self, objs: List[object]):
+        """
+        Insert or update objects of one class and persist them with a
+        single write.
+        """
+        if not objs:
+            return
+        cls = type(objs[0])
+        with cls._lock(), self._merging(cls):
+            data = self.objects(cls)
+            for obj in objs:
+                self._index_remove(cls, obj.id)
+                self._index_add(cls, obj)
+                data[obj.id] = obj
+            self._persist(cls, objs)
+
+    def remove_many(self, objs: List[object]) -> int:
+        """
+        Delete objects of one class with a single write and return
+        how many existed.
+        """
+        if not objs:
+            return 0
+        cls = type(objs[0])
+        removed = []
+        with cls._lock(), self._merging(cls):
+            data = self.objects(cls)
+            for obj in objs:
+                if data.pop(obj.id, None) is not None:
+                    self._index_remove(cls, obj.id)
+                    removed.append(obj)
+            if removed:
+                self._persist(cls, removed, removed=True)
+        return len(removed)
+
+    def get(self, cls: type, obj_id: str) -> object:
+        """
+        Return the object with the given id, or None.
+        """
+        return self.objects(cls).get(obj_id)
+
+    def count(self, cls: type) -> int:
+        """
+        Return the number of stored objects of a class.
+        """
+        return len(self.objects(cls))
+
+    def search(self, cls: type, attributes: dict = {}) -> List[object]:
+        """
+        Return the objects whose attributes equal the given values.
+        Uses a hash index when one covers a searched attribute.
+        """
+        candidates = self.objects(cls)
+        for attr in cls._indexed_attributes:
+            if attr not in attributes:
+                continue
+            try:
+                bucket = self.indexes(cls)[attr].get(attributes[attr], {})
+            except TypeError:
+                continue
+            candidates = bucket
+            break
+        candidates = list(candidates.values())
+        if not attributes:
+            return candidates
+
+        def _search(obj):
+            return all(getattr(obj, k) == v for k, v in attributes.items())
+
+        return list(filter(_search, candidates))
+
+    def paginate(self, cls: type, limit: int,
+                 after: tuple = None) -> List[object]:
+        """
+        Return up to `limit` objects ordered by (created_at, id),
+        starting just after the `after` ordering key.
+        """
+        objs = self.objects(cls)
+        entries = self.sorted_indexes(cls).get('created_at')
+        if entries is None:
+            ordered = sorted(objs.values(), key=cls.order_key)
+            start = 0
+            if after is not None:
+                start = bisect.bisect_right(ordered, tuple(after),
+                                            key=cls.order_key)
+            return ordered[start:start + limit]
+        start = 0
+        if after is not None:
+            start = bisect.bisect_right(entries, tuple(after))
+        return [objs[obj_id] for _, obj_id in entries[start:start + limit]
+                if obj_id in objs]
+
+    def query(self, cls: type, attr: str, start: object = None,
+              end: object = None, descending: bool = False,
+              limit: int = None, offset: int = 0) -> List[object]:
+        """
+        Return objects ordered by `attr` (then id) whose value lies in
+        [start, end), skipping `offset` and returning at most `limit`.
+        Served from a sorted index when `attr` is in _sorted_attributes.
+        """
+        objs = self.objects(cls)
+        entries = self.sorted_indexes(cls).get(attr)
+        if entries is None:
+            entries = sorted((getattr(obj, attr), obj.id)
+                             for obj in list(objs.values())
+                             if getattr(obj, attr) is not None)
+        lo = 0 if start is None else bisect.bisect_left(entries, (start,))
+        hi = len(entries) if end is None else \
+            bisect.bisect_left(entries, (end,))
+        if descending:
+            hi = max(lo, hi - offset)
+            if limit is not None:
+                lo = max(lo, hi - limit)
+            selected = reversed(entries[lo:hi])
+        else:
+            lo = min(hi, lo + offset)
+            if limit is not None:
+                hi = min(hi, lo + limit)
+            selected = entries[lo:hi]
+        return [objs[obj_id] for _, obj_id in selected if obj_id in objs]
+
+
+def _flush_loop(storage: FileStorage):
+    """
+    Background write-behind loop: flush on interval or when asked.
+    """
+    while True:
+        _flush_requested.wait(WRITE_BEHIND_INTERVAL)
+        _flush_requested.clear()
+        try:
+            storage.flush()
+        except Exception:
+            logger.exception("Write-behind flush failed; will retry")
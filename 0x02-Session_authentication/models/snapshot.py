@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Compact binary snapshot format for model objects.
+
+Layout: the magic bytes, a one-byte format version, a one-byte marshal
+version, then a marshal payload `(fields, datetime_fields, rows)` where
+every row is a tuple of attribute values in `fields` order and datetimes
+are stored as whole seconds since the epoch, so loading never parses
+timestamp strings.
+
+The payload is always written with marshal version MARSHAL_VERSION
+rather than the interpreter default, so a Python upgrade does not change
+the encoding.
+"""
+
+from datetime import datetime, timedelta
+from typing import BinaryIO, Dict
+import marshal
+
+SNAPSHOT_MAGIC = b"BASESNAP"
+SNAPSHOT_VERSION = 1
+MARSHAL_VERSION = 4
+EPOCH = datetime(1970, 1, 1)
+
+
+def dump(objs: Dict[str, object], f: BinaryIO):
+    """
+    Write the objects (id -> object) to a binary snapshot.
+    """
+    fields = {}
+    datetime_fields = set()
+    for obj in objs.values():
+        for key, value in obj._attributes().items():
+            fields.setdefault(key, None)
+            if type(value) is datetime:
+                datetime_fields.add(key)
+    fields = list(fields)
+
+    rows = []
+    for obj in objs.values():
+        attrs = obj._attributes()
+        row = []
+        for key in fields:
+            value = attrs.get(key)
+            if type(value) is datetime:
+                value = int((value - EPOCH).total_seconds())
+            row.append(value)
+        rows.append(tuple(row))
+
+    f.write(SNAPSHOT_MAGIC + bytes([SNAPSHOT_VERSION, MARSHAL_VERSION]))
+    marshal.dump((tuple(fields), tuple(sorted(datetime_fields)),
+                  tuple(rows)), f, MARSHAL_VERSION)
+
+
+def load(cls: type, f: BinaryIO) -> Dict[str, object]:
+    """
+    Read a binary snapshot and return its objects (id -> object).
+    Objects are rebuilt without going through `cls.__init__`.
+    """
+    header = f.read(len(SNAPSHOT_MAGIC) + 1)
+    if header[:-1] != SNAPSHOT_MAGIC:
+        raise ValueError("Not a model snapshot file")
+    if header[-1] != SNAPSHOT_VERSION:
+        raise ValueError(f"Unsupported snapshot version {header[-1]}")
+    marshal_version = f.read(1)[0]
+    if marshal_version > marshal.version:
+        raise ValueError(f"Snapshot needs marshal version {marshal_version}"
+                         f", this Python reads up to {marshal.version}")
+    fields, datetime_fields, rows = marshal.load(f)
+
+    datetime_columns = [fields.index(key) for key in datetime_fields]
+    id_column = fields.index('id')
+    objs = {}
+    new = cls.__new__
+    for row in rows:
+        if datetime_columns:
+            row = list(row)
+            for i in datetime_columns:
+                if row[i] is not None:
+                    row[i] = EPOCH + timedelta(seconds=row[i])
+        obj = new(cls)
+        for key, value in zip(fields, row):
+            setattr(obj, key, value)
+        objs[row[id_column]] = obj
+    return objs
+
+
+if __name__ == "__main__":
+    import sys
+    from models.file_storage import FileStorage
+    from models.user import User
+    from models.user_session import UserSession
+
+    if len(sys.argv) != 3 or sys.argv[2] not in ("json", "binary"):
+        sys.exit("Usage: python3 -m models.snapshot <User|UserSession> "
+                 "<json|binary>")
+    model = {"User": User, "UserSession": UserSession}[sys.argv[1]]
+    FileStorage().convert_snapshot(model, sys.argv[2])
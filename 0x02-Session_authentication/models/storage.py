@@ -0,0 +1,363 @@
+#!/usr/bin/env python3
+"""
+Storage backends for model objects.
+
+`Storage` is the interface `Base` delegates every lookup and write to;
+`models.file_storage.FileStorage` (in-memory objects persisted to JSON
+or binary snapshots and an optional journal) is the default and
+`SQLiteStorage` keeps objects in an embedded database instead.
+"""
+
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import List
+import sqlite3
+import threading
+
+EPOCH = datetime(1970, 1, 1)
+
+
+class Storage:
+    """
+    Interface of a model storage backend.
+
+    Methods taking `cls` act on the objects of that model class;
+    `save_many` and `remove_many` receive objects of a single class.
+    """
+
+    def load(self, cls: type):
+        """
+        Make the stored objects of a class available.
+        """
+        raise NotImplementedError
+
+    def sync(self, cls: type, interval: float = 0) -> bool:
+        """
+        Pick up changes other processes made, checking at most once per
+        `interval` seconds; return True when the class data changed.
+        """
+        return False
+
+    def save_all(self, cls: type):
+        """
+        Persist every object of a class held by this backend.
+        """
+
+    def flush(self):
+        """
+        Persist changes the backend has deferred.
+        """
+
+    def generation(self, cls: type) -> str:
+        """
+        Return a token that changes whenever objects of the class are
+        changed by any process, or None when the backend cannot tell;
+        `Base.generation` then falls back to a per-process counter.
+        """
+        return None
+
+    def get(self, cls: type, obj_id: str) -> object:
+        """
+        Return the object with the given id, or None.
+        """
+        raise NotImplementedError
+
+    def search(self, cls: type, attributes: dict = {}) -> List[object]:
+        """
+        Return the objects whose attributes equal the given values.
+        """
+        raise NotImplementedError
+
+    def count(self, cls: type) -> int:
+        """
+        Return the number of stored objects of a class.
+        """
+        raise NotImplementedError
+
+    def save_many(self, objs: List[object]):
+        """
+        Insert or update objects of one class.
+        """
+        raise NotImplementedError
+
+    def remove_many(self, objs: List[object]) -> int:
+        """
+        Delete objects of one class and return how many existed.
+        """
+        raise NotImplementedError
+
+    def paginate(self, cls: type, limit: int,
+                 after: tuple = None) -> List[object]:
+        """
+        Return up to `limit` objects ordered by (created_at, id),
+        starting just after the `after` ordering key.
+        """
+        raise NotImplementedError
+
+    def query(self, cls: type, attr: str, start: object = None,
+              end: object = None, descending: bool = False,
+              limit: int = None, offset: int = 0) -> List[object]:
+        """
+        Return objects ordered by `attr` (then id) whose value lies in
+        [start, end), skipping `offset` and returning at most `limit`.
+        """
+        raise NotImplementedError
+
+
+class SQLiteStorage(Storage):
+    """
+    Store model objects in an embedded SQLite database.
+
+    Every model class gets its own table with one column per attribute
+    and an index on each of its `_indexed_attributes`; lookups run as
+    SQL queries, so objects only live in memory while a caller holds
+    them. Triggers count the writes to each table in `_generations`,
+    so `generation` sees changes made by other processes.
+    """
+
+    def __init__(self, db_path: str):
+        """
+        Initialize the backend for the database file at db_path.
+        """
+        self.db_path = db_path
+        self._local = threading.local()
+        self._tables = set()
+        self._lock = threading.Lock()
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        """
+        Return the connection of the calling thread.
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        """
+        Run the enclosed statements in one transaction.
+        """
+        conn = self.connection
+        conn.execute("BEGIN")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def load(self, cls: type):
+        """
+        Create the table of a class if missing.
+        """
+        self.create_table(cls)
+
+    def create_table(self, cls: type):
+        """
+        Create the table and indexes of a model class if missing.
+        """
+        table = cls.__name__
+        if table in self._tables:
+            return
+        with self._lock:
+            columns = ", ".join(
+                '"id" TEXT PRIMARY KEY' if name == 'id' else f'"{name}"'
+                for name in cls._fields())
+            self.connection.execute(
+                f'CREATE TABLE IF NOT EXISTS "{table}" ({columns})')
+            for name in set(cls._indexed_attributes +
+                            cls._sorted_attributes):
+                self.connection.execute(
+                    f'CREATE INDEX IF NOT EXISTS "ix_{table}_{name}" '
+                    f'ON "{table}" ("{name}")')
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS "_generations" '
+                '("name" TEXT PRIMARY KEY, "counter" INTEGER NOT NULL)')
+            self.connection.execute(
+                'INSERT OR IGNORE INTO "_generations" VALUES (?, 0)',
+                (table,))
+            for event in ("INSERT", "UPDATE", "DELETE"):
+                self.connection.execute(
+                    f'CREATE TRIGGER IF NOT EXISTS "gen_{table}_{event}" '
+                    f'AFTER {event} ON "{table}" BEGIN '
+                    f'UPDATE "_generations" SET "counter" = "counter" + 1 '
+                    f'WHERE "name" = \'{table}\'; END')
+            self._tables.add(table)
+
+    def _columns(self, cls: type) -> str:
+        """
+        Return the quoted column list of a model class.
+        """
+        return ", ".join(f'"{name}"' for name in cls._fields())
+
+    def _to_row(self, obj: object) -> tuple:
+        """
+        Return the column values of an object.
+        """
+        row = []
+        for name in obj._fields():
+            value = getattr(obj, name, None)
+            if type(value) is datetime:
+                value = int((value - EPOCH).total_seconds())
+            row.append(value)
+        return tuple(row)
+
+    def _from_row(self, cls: type, row: tuple) -> object:
+        """
+        Rebuild an object from its column values.
+        """
+        obj = cls.__new__(cls)
+        for name, value in zip(cls._fields(), row):
+            if name in cls._datetime_attributes and value is not None:
+                value = EPOCH + timedelta(seconds=value)
+            setattr(obj, name, value)
+        return obj
+
+    def save(self, obj: object):
+        """
+        Insert or update one object, keeping its original position.
+        """
+        self.save_many([obj])
+
+    def save_many(self, objs: List[object]):
+        """
+        Insert or update objects of one class in a single transaction.
+        """
+        if not objs:
+            return
+        cls = type(objs[0])
+        self.create_table(cls)
+        fields = cls._fields()
+        columns = self._columns(cls)
+        updates = ", ".join(f'"{name}" = excluded."{name}"'
+                            for name in fields if name != 'id')
+        with self.transaction() as conn:
+            conn.executemany(
+                f'INSERT INTO "{cls.__name__}" ({columns}) '
+                f'VALUES ({", ".join("?" * len(fields))}) '
+                f'ON CONFLICT ("id") DO UPDATE SET {updates}',
+                [self._to_row(obj) for obj in objs])
+
+    def remove(self, obj: object) -> bool:
+        """
+        Delete one object and tell whether it existed.
+        """
+        return self.remove_many([obj]) > 0
+
+    def remove_many(self, objs: List[object]) -> int:
+        """
+        Delete objects of one class in a single transaction and return
+        how many existed.
+        """
+        if not objs:
+            return 0
+        cls = type(objs[0])
+        self.create_table(cls)
+        with self.transaction() as conn:
+            cursor = conn.executemany(
+                f'DELETE FROM "{cls.__name__}" WHERE "id" = ?',
+                [(obj.id,) for obj in objs])
+        return cursor.rowcount
+
+    def generation(self, cls: type) -> str:
+        """
+        Return the change counter of the class table, which triggers
+        bump on every row written by any connection.
+        """
+        self.create_table(cls)
+        counter = self.connection.execute(
+            'SELECT "counter" FROM "_generations" WHERE "name" = ?',
+            (cls.__name__,)).fetchone()[0]
+        return f"sqlite-{counter}"
+
+    def get(self, cls: type, obj_id: str) -> object:
+        """
+        Return the object with the given id, or None.
+        """
+        self.create_table(cls)
+        row = self.connection.execute(
+            f'SELECT {self._columns(cls)} FROM "{cls.__name__}" '
+            f'WHERE "id" = ?', (obj_id,)).fetchone()
+        return None if row is None else self._from_row(cls, row)
+
+    def count(self, cls: type) -> int:
+        """
+        Return the number of stored objects of a class.
+        """
+        self.create_table(cls)
+        return self.connection.execute(
+            f'SELECT COUNT(*) FROM "{cls.__name__}"').fetchone()[0]
+
+    def search(self, cls: type, attributes: dict = {}) -> List[object]:
+        """
+        Return the objects whose attributes equal the given values.
+        """
+        self.create_table(cls)
+        fields = cls._fields()
+        clauses, params = [], []
+        for name, value in attributes.items():
+            if name not in fields:
+                raise AttributeError(
+                    f"'{cls.__name__}' object has no attribute '{name}'")
+            if type(value) is datetime:
+                value = int((value - EPOCH).total_seconds())
+            if value is None:
+                clauses.append(f'"{name}" IS NULL')
+                continue
+            clauses.append(f'"{name}" = ?')
+            params.append(value)
+        where = f' WHERE {" AND ".join(clauses)}' if clauses else ''
+        rows = self.connection.execute(
+            f'SELECT {self._columns(cls)} FROM "{cls.__name__}"{where} '
+            f'ORDER BY rowid', params)
+        return [self._from_row(cls, row) for row in rows]
+
+    def paginate(self, cls: type, limit: int,
+                 after: tuple = None) -> List[object]:
+        """
+        Return up to `limit` objects ordered by (created_at, id),
+        starting just after the `after` ordering key.
+        """
+        self.create_table(cls)
+        where, params = '', []
+        if after is not None:
+            created_at, obj_id = after
+            where = ' WHERE ("created_at", "id") > (?, ?)'
+            params = [int((created_at - EPOCH).total_seconds()), obj_id]
+        rows = self.connection.execute(
+            f'SELECT {self._columns(cls)} FROM "{cls.__name__}"{where} '
+            f'ORDER BY "created_at", "id" LIMIT ?', params + [limit])
+        return [self._from_row(cls, row) for row in rows]
+
+    def query(self, cls: type, attr: str, start: object = None,
+              end: object = None, descending: bool = False,
+              limit: int = None, offset: int = 0) -> List[object]:
+        """
+        Return objects ordered by `attr` (then id) whose value lies in
+        [start, end), skipping `offset` and returning at most `limit`.
+        """
+        self.create_table(cls)
+        if attr not in cls._fields():
+            raise AttributeError(
+                f"'{cls.__name__}' object has no attribute '{attr}'")
+        clauses, params = [f'"{attr}" IS NOT NULL'], []
+        for op, value in ((">=", start), ("<", end)):
+            if value is None:
+                continue
+            if type(value) is datetime:
+                value = int((value - EPOCH).total_seconds())
+            clauses.append(f'"{attr}" {op} ?')
+            params.append(value)
+        direction = "DESC" if descending else "ASC"
+        rows = self.connection.execute(
+            f'SELECT {self._columns(cls)} FROM "{cls.__name__}" '
+            f'WHERE {" AND ".join(clauses)} '
+            f'ORDER BY "{attr}" {direction}, "id" {direction} '
+            f'LIMIT ? OFFSET ?',
+            params + [-1 if limit is None else limit, offset])
+        return [self._from_row(cls, row) for row in rows]
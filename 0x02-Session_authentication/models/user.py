@@ -12,6 +12,10 @@ class User(Base):
     User class for storing user details.
     """
 
+    __slots__ = ('email', '_password', 'first_name', 'last_name')
+    _indexed_attributes = ('email',)
+    _sorted_attributes = ('created_at', 'email')
+
     def __init__(self, *args: list, **kwargs: dict):
         """
         Initializes a User instance.
@@ -11,6 +11,9 @@ class UserSession(Base):
     User session class for storing session information.
     """
 
+    __slots__ = ('user_id', 'session_id')
+    _indexed_attributes = ('session_id',)
+
     def __init__(self, *args: list, **kwargs: dict):
         """
         Initializes a UserSession instance.